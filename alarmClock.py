@@ -1,52 +1,481 @@
-import sqlite3, re, datetime, json, subprocess, threading, time, signal, os
-import tkinter.messagebox as msgBox
+import abc, sqlite3, re, datetime, json, threading, time, os, heapq, csv, logging, socket, secrets
+from concurrent.futures import ThreadPoolExecutor
 from prettytable import PrettyTable
 
 from dotenv import dotenv_values
 
-# читаем .env файлик
-env = dotenv_values()
-# открываем соединение с базой
-dbCon = sqlite3.connect(env.get('dbFile', 'ac.db') )
+from db import Database
+from player import SpawnPlayer, IpcPlayer, SilentPlayer
+from sounds import SoundLibrary
+from notify import NOTIFIERS, defaultNotifier
+from metrics import Metrics, NullMetrics
+from evaluator import AlarmTable
+from clock import SystemClock
+
+
+def _legacyRow(aId, aTime, cond, pid):
+    ''' строка будильника схемы v1 из json-условий исходной схемы '''
+    return (aId, aTime, *Alarm.condToColumns(cond)[:-1], cond.get('soundN'), pid)
+
+
+def _migrateCondColumns(con):
+    ''' v1: условия будильника из json-поля cond раскладываем по отдельным колонкам '''
+    con.execute('alter table alarms rename to alarms_v0')
+    con.execute('''create table alarms (
+        id integer,
+        time integer not null,
+        date integer,
+        days integer not null default 127,
+        rcount integer not null default 0,
+        rinterval integer not null default 0,
+        msg text,
+        soundN integer,
+        pid integer,
+        constraint pk primary key (id autoincrement)
+    );''')
+    con.execute('create index alarms_due on alarms (time, date, days)')
+    rows = con.execute('select id, time, cond, pid from alarms_v0').fetchall()
+    con.executemany(
+        'insert into alarms (id, time, date, days, rcount, rinterval, msg, soundN, pid) values (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (_legacyRow(aId, aTime, json.loads(cond) if cond else {}, pid) for (aId, aTime, cond, pid) in rows)
+    )
+    con.execute('drop table alarms_v0')
+
+
+def _migrateChangeLog(con):
+    ''' v2: журнал изменений будильников (для инкрементального обновления кэша звонилки) '''
+    con.execute('''create table alarmChanges (
+        seq integer primary key autoincrement,
+        aid integer not null,
+        ts integer not null default (cast(strftime('%s', 'now') as integer))
+    );''')
+    # пишем в журнал любые изменения условий будильника (но не pid звонилки)
+    con.execute('create trigger alarmsInsertLog after insert on alarms begin insert into alarmChanges (aid) values (new.id); end')
+    con.execute('create trigger alarmsDeleteLog after delete on alarms begin insert into alarmChanges (aid) values (old.id); end')
+    con.execute('''create trigger alarmsUpdateLog after update of time, date, days, rcount, rinterval, msg, soundN on alarms
+        begin insert into alarmChanges (aid) values (new.id); end''')
+
+
+def _migrateRepeats(con):
+    ''' v3: ожидающие повторы будильников (переживают перезапуск приложения) '''
+    con.execute('''create table repeats (
+        aid integer primary key,
+        fireAt integer not null,
+        left integer not null,
+        interval integer not null
+    );''')
+    con.execute('create trigger alarmsDeleteRepeats after delete on alarms begin delete from repeats where aid = old.id; end')
+
+
+def _migrateSoundIndex(con):
+    ''' v4: индекс мелодий с постоянными id; будильники ссылаются на id мелодии, а не на позицию файла в каталоге '''
+    con.execute('''create table sounds (
+        id integer primary key autoincrement,
+        path text not null unique,
+        name text not null,
+        size integer,
+        mtime integer,
+        duration real,
+        present integer not null default 1
+    );''')
+    con.execute('create table meta (key text primary key, value text)')
+    con.execute('alter table alarms rename column soundN to soundId')
+    # старые номера мелодий - позиции в порядке os.scandir каталога
+    positions = []
+    soundDir = app.env.get('soundDir')
+    if soundDir and os.path.isdir(soundDir):
+        for entry in os.scandir(soundDir):
+            if entry.is_file():
+                cursor = con.execute('insert into sounds (path, name) values (?, ?)', (entry.path, entry.name,))
+                positions.append((cursor.lastrowid, len(positions)))
+    con.execute('create temp table soundPositions (id integer, pos integer)')
+    con.executemany('insert into soundPositions (id, pos) values (?, ?)', positions)
+    con.execute('update alarms set soundId = (select id from soundPositions where pos = alarms.soundId) where soundId is not null')
+    con.execute('drop table soundPositions')
+
+
+def _migrateClaims(con):
+    ''' v5: захват звонков экземплярами приложения (несколько экземпляров на одной базе) '''
+    con.execute('''create table claims (
+        aid integer not null,
+        fireAt integer not null,
+        owner text not null,
+        leaseUntil integer not null,
+        done integer not null default 0,
+        primary key (aid, fireAt)
+    );''')
+    con.execute('create trigger alarmsDeleteClaims after delete on alarms begin delete from claims where aid = old.id; end')
+    # кто запустил плеер звонящего будильника
+    con.execute('alter table alarms add column owner text')
+
+
+def _migrateFirings(con):
+    ''' v6: журнал звонков (аудит): каждый звонок, повтор и звонок, пропущенный из-за опоздания '''
+    con.execute('''create table firings (
+        seq integer primary key autoincrement,
+        aid integer not null,
+        fireAt integer not null,
+        firedAt real,
+        kind text not null,
+        owner text
+    );''')
+    # журнал только дополняется
+    con.execute("create trigger firingsNoUpdate before update on firings begin select raise(abort, 'firings: только добавление'); end")
+
+
+# Миграции схемы базы: i-я миграция переводит базу в версию i + 1 (PRAGMA user_version)
+MIGRATIONS = (
+    _migrateCondColumns,
+    _migrateChangeLog,
+    _migrateRepeats,
+    _migrateSoundIndex,
+    _migrateClaims,
+    _migrateFirings,
+)
+
+
+def migrateDb(con):
+    ''' приведение схемы базы к последней версии
+        :param con: соединение с базой
+    '''
+    # добавляем таблицу будильников (исходная схема), если её нет
+    con.execute('''create table if not exists alarms (
+        id integer,
+        time integer  not null,
+        cond text,
+        pid integet,
+        constraint pk primary key (id autoincrement)
+    );''')
+    while con.execute('pragma user_version').fetchone()[0] < len(MIGRATIONS):
+        # миграция целиком в одной транзакции (вместе с DDL); версию перечитываем под блокировкой записи -
+        # несколько экземпляров на одной базе могут мигрировать её одновременно
+        con.execute('begin immediate')
+        with con:
+            version = con.execute('pragma user_version').fetchone()[0]
+            if version < len(MIGRATIONS):
+                MIGRATIONS[version](con)
+                con.execute(f'pragma user_version = {version + 1}')
+
+
+class AppContext:
+    ''' Контекст приложения: настройки, база, мелодии, плеер, уведомления и метрики.
+        Всё создаётся при первом обращении, а не при импорте модуля
+    '''
+
+    def __init__(self, env=None):
+        ''' :param env: настройки поверх файла .env '''
+        self.__envOverrides = dict(env or {})
+        self.__env = None
+        self.__db = None
+        self.__sounds = None
+        self.__player = None
+        self.__metrics = None
+        self.__instanceId = None
+        self.__lock = threading.RLock()
+        # обработчик сообщений будильника: callable(заголовок, текст), если пусто - по настройке notifier
+        self.notifier = None
+        # часы планировщика (в прогоне расписания - clock.VirtualClock)
+        self.clock = SystemClock()
+        # журнал событий звонков: callable(событие, id будильника, момент, подробности), если пусто - не ведётся
+        self.recorder = None
 
-cursor = dbCon.cursor()
-# добавляем таблицу будильников, если её нет
-cursor.execute('''create table if not exists alarms (
-    id integer,
-    time integer  not null,
-    cond text,
-    pid integet,
-    constraint pk primary key (id autoincrement)
-);''')
-cursor.close()
 
-soundDir = env.get('soundDir', None)
+    @property
+    def env(self):
+        ''' настройки (.env читается при первом обращении) '''
+        if self.__env is None:
+            self.__env = {**dotenv_values(), **self.__envOverrides}
+        return self.__env
+
+
+    @property
+    def dbFile(self):
+        ''' файл базы будильников '''
+        return self.env.get('dbFile', 'ac.db')
+
+
+    @property
+    def db(self):
+        ''' база будильников (схема приводится к актуальной при первом обращении) '''
+        with self.__lock:
+            if self.__db is None:
+                # пока другой экземпляр мигрирует базу, ждём как писатель
+                con = sqlite3.connect(self.dbFile, timeout=Database.BUSY_TIMEOUT)
+                migrateDb(con)
+                con.close()
+                self.__db = Database(self.dbFile, self.metrics)
+            return self.__db
+
+
+    @property
+    def instanceId(self):
+        ''' имя экземпляра приложения (владелец захваченных звонков и запущенных плееров) '''
+        if self.__instanceId is None:
+            self.__instanceId = self.env.get('instanceId') or f'{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(4)}'
+        return self.__instanceId
+
+
+    @property
+    def metrics(self):
+        ''' метрики: metricsPort - HTTP на локальном порту, metricsFile - файл; без них метрики выключены '''
+        if self.__metrics is None:
+            with self.__lock:
+                if self.__metrics is None:
+                    (port, path) = (self.env.get('metricsPort'), self.env.get('metricsFile'))
+                    if not port and not path:
+                        self.__metrics = NullMetrics()
+                        return self.__metrics
+                    metrics = Metrics(path)
+                    # база не открывается ради метрик: пока её нет, датчик пропускается
+                    metrics.gauge('alarm_ringing', lambda: self.__db.reader().execute('select count(*) from alarms where pid > 0').fetchone()[0])
+                    if port:
+                        metrics.serve(int(port), self.env.get('metricsHost') or '127.0.0.1')
+                    self.__metrics = metrics
+        return self.__metrics
+
+
+    @property
+    def sounds(self):
+        ''' индекс мелодий, актуализированный (один раз за запуск) по каталогу soundDir '''
+        if self.__sounds is None:
+            self.__sounds = SoundLibrary(self.env.get('soundDir'))
+            self.__sounds.rescan(self.db)
+        return self.__sounds
+
+
+    @property
+    def player(self):
+        ''' проигрыватель мелодий (playerMode=ipc - один тёплый процесс плеера, none - без звука) '''
+        with self.__lock:
+            if self.__player is None:
+                if self.env.get('playerMode') == 'ipc':
+                    self.__player = IpcPlayer(self.env.get('player'), self.env.get('playerSocket'))
+                elif self.env.get('playerMode') == 'none':
+                    self.__player = SilentPlayer()
+                else:
+                    self.__player = SpawnPlayer(self.env.get('player'))
+            return self.__player
+
+
+    @property
+    def traceTicks(self):
+        ''' журнал каждого тика планировщика и задержек звонков (traceTicks=1) '''
+        return self.env.get('traceTicks') in ('1', 'true', 'yes')
+
+
+    def configureLogging(self):
+        ''' вывод журнала в stderr; с traceTicks - и сообщения INFO логгера alarmClock (тики, задержки звонков) '''
+        if self.traceTicks:
+            logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+            logging.getLogger('alarmClock').setLevel(logging.INFO)
+
+
+    def notify(self, title, text):
+        ''' показ сообщения будильника (notifier: tk, stdout, log, none) '''
+        notifier = self.notifier or NOTIFIERS[self.env.get('notifier') or defaultNotifier()]
+        notifier(title, text)
+
+
+    def record(self, event, aId, **details):
+        ''' событие звонка (ring, repeat, stop) в журнал, если он ведётся '''
+        if self.recorder is not None:
+            self.recorder(event, aId, self.clock.now(), details)
+
+
+    def close(self):
+        ''' освобождение ресурсов при выходе из приложения '''
+        with self.__lock:
+            if self.__metrics is not None:
+                self.__metrics.close()
+                self.__metrics = None
+            if self.__player is not None:
+                self.__player.close()
+                self.__player = None
+            if self.__db is not None:
+                self.__db.close()
+                self.__db = None
+
 
-# Список, того что можно поиграть ....
-soundFiles = []
+# Контекст приложения по умолчанию
+app = AppContext()
 
-if soundDir and os.path.exists(soundDir):
-    soundFiles = [sItem for sItem in os.scandir(soundDir) if sItem.is_file()]
+# Сигнал планировщику: набор будильников изменился (сохранение / удаление)
+alarmsChanged = threading.Event()
 
 
 class Alarm:
-    ''' Класс одного будильника '''
+    ''' Класс одного будильника.
+        Будильник из базы хранит строку таблицы как есть, а словарь условий _cond
+        разбирается из неё только при первом обращении (остановке, звонилке и т.п. он не нужен)
+    '''
+    __slots__ = ('_id', '_time', '_pid', '_owner', '__row', '__cond', '__hasErrors', )
     # дни недели
     DAYS = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
     # колонки загружаемые из таблицы будильников как отдельные поля
-    ALARM_COLUMNS = ('id', 'time', 'cond', 'pid', )
-    # Наличие ошибок валидации
-    __hasErrors = False
+    ALARM_COLUMNS = ('id', 'time', 'date', 'days', 'rcount', 'rinterval', 'msg', 'soundId', 'pid', 'owner', )
+    # колонки, в которых хранятся условия будильника
+    COND_COLUMNS = ('date', 'days', 'rcount', 'rinterval', 'msg', 'soundId', )
+    # маска "все дни недели"
+    ALL_DAYS = 0b1111111
+    # поля записи будильника при импорте / экспорте (аргументы __initFrom3Args)
+    RECORD_FIELDS = ('time', 'when', 'repeat', 'msg', 'sound', )
+    # сколько проверенных записей импорта пишется в базу одной транзакцией
+    IMPORT_CHUNK = 1000
 
 
     @classmethod
     def getAll(cls):
         ''' достать все записи будильников '''
-        cursor = dbCon.cursor()
-        cursor.execute('select * from alarms')
+        cursor = app.db.reader().cursor()
+        cursor.execute(f'select {", ".join(cls.ALARM_COLUMNS)} from alarms')
         rows = cursor.fetchall()
         cursor.close()
-        return [cls(dict(zip(cls.ALARM_COLUMNS, row))) for row in rows]
+        return [cls.fromRow(row) for row in rows]
+
+
+    @classmethod
+    def iterAll(cls, chunk=1000):
+        ''' перебор всех будильников порциями из курсора (без загрузки всей таблицы в память)
+            :param chunk: размер порции
+        '''
+        return cls.query(chunk=chunk)
+
+
+    @classmethod
+    def filterSql(cls, filters):
+        ''' фильтры списка будильников -> условия для where
+            :param filters: словарь: from / to - время звонка чч:мм (включительно), day - день недели,
+                kind - dated (на дату) / recurring (повторяющиеся), ringing - только звонящие
+            :return: (список условий, параметры)
+        '''
+        where, params = [], []
+        for (key, op) in (('from', '>='), ('to', '<=')):
+            if filters.get(key):
+                t = re.match(r'^(\d{2}):(\d{2})$', str(filters[key]).strip())
+                if t is None or int(t.group(1)) > 23 or int(t.group(2)) > 59:
+                    raise ValueError(f'Не верный формат времени: {filters[key]}')
+                where.append(f'time {op} ?')
+                params.append(int(t.group(1)) * 60 + int(t.group(2)))
+        if filters.get('day'):
+            if filters['day'] not in cls.DAYS:
+                raise ValueError(f'Неизвестный день недели: {filters["day"]}')
+            day = cls.DAYS.index(filters['day'])
+            # у будильника на дату день недели считаем по самой дате (ordinal 1 - понедельник)
+            where.append('(case when date is null then days & ? != 0 else (date - 1) % 7 = ? end)')
+            params.extend((1 << day, day,))
+        kind = filters.get('kind')
+        if kind == 'dated':
+            where.append('date is not null')
+        elif kind == 'recurring':
+            where.append('date is null')
+        elif kind:
+            raise ValueError(f'Неизвестный вид будильников: {kind}')
+        if filters.get('ringing'):
+            where.append('pid > 0')
+        return (where, params)
+
+
+    @classmethod
+    def query(cls, filters=None, after=0, limit=None, chunk=1000):
+        ''' будильники по фильтрам в порядке id, порциями из курсора (постраничный вывод - по ключу id)
+            :param filters: фильтры (см. filterSql)
+            :param after: только будильники с id больше этого
+            :param limit: сколько будильников вернуть, None - все
+            :param chunk: размер порции чтения из курсора
+        '''
+        (where, params) = cls.filterSql(filters or {})
+        sql = f'select {", ".join(cls.ALARM_COLUMNS)} from alarms where {" and ".join(["id > ?", *where])} order by id'
+        params = [int(after or 0), *params]
+        if limit:
+            sql += ' limit ?'
+            params.append(int(limit))
+        cursor = app.db.reader().cursor()
+        cursor.execute(sql, params)
+        while rows := cursor.fetchmany(chunk):
+            for row in rows:
+                yield cls.fromRow(row)
+        cursor.close()
+
+
+    @classmethod
+    def importFrom(cls, stream, fmt='csv'):
+        ''' массовый импорт будильников порциями по IMPORT_CHUNK записей (порция - одна транзакция)
+            :param stream: открытый текстовый поток с записями
+            :param fmt: формат записей: csv (с заголовком RECORD_FIELDS) или jsonl
+            :return: (число добавленных будильников, список (номер строки, ошибка))
+        '''
+        if fmt == 'csv':
+            reader = csv.DictReader(stream)
+            records = ((reader.line_num, rec) for rec in reader)
+        elif fmt == 'jsonl':
+            records = ((lineNo, line) for (lineNo, line) in enumerate(stream, 1) if line.strip())
+        else:
+            raise ValueError(f'Неизвестный формат импорта: {fmt}')
+
+        errors = []
+        # индекс мелодий нужен для проверки записей
+        app.sounds
+        sql = f'insert into alarms (time, {", ".join(cls.COND_COLUMNS)}) values(?, ?, ?, ?, ?, ?, ?)'
+        # записи проверяются в этом потоке: пока пишется одна порция, проверяется следующая,
+        # а блокировка записи держится только на время executemany готовой порции
+        (count, pending, chunk) = (0, None, [])
+
+        def wait():
+            ''' ожидание записи предыдущей порции '''
+            nonlocal count, pending
+            if pending is not None:
+                (written, pending) = (pending, None)
+                count += max(written.result(), 0)
+
+        def flush():
+            nonlocal pending, chunk
+            wait()
+            if chunk:
+                (pending, chunk) = (app.db.call(lambda con, rows=chunk: con.executemany(sql, rows).rowcount), [])
+
+        try:
+            for (lineNo, rec) in records:
+                try:
+                    if fmt == 'jsonl':
+                        rec = json.loads(rec)
+                        if not isinstance(rec, dict):
+                            raise TypeError('Запись должна быть объектом')
+                    alarm = cls(*(str(rec.get(k) or '') for k in cls.RECORD_FIELDS))
+                except (TypeError, ValueError) as e:
+                    errors.append((lineNo, str(e)))
+                    continue
+                chunk.append((alarm._time, *cls.condToColumns(alarm._cond),))
+                if len(chunk) >= cls.IMPORT_CHUNK:
+                    flush()
+            flush()
+            wait()
+        finally:
+            if count:
+                alarmsChanged.set()
+        return (count, errors)
+
+
+    @classmethod
+    def exportTo(cls, stream, fmt='csv'):
+        ''' выгрузка всех будильников в формате, пригодном для importFrom
+            :param stream: открытый текстовый поток для записи
+            :param fmt: формат записей: csv или jsonl
+            :return: число выгруженных будильников
+        '''
+        if fmt not in ('csv', 'jsonl'):
+            raise ValueError(f'Неизвестный формат экспорта: {fmt}')
+        writer = None
+        if fmt == 'csv':
+            writer = csv.DictWriter(stream, cls.RECORD_FIELDS)
+            writer.writeheader()
+        count = 0
+        for alarm in cls.iterAll():
+            if writer:
+                writer.writerow(alarm.record)
+            else:
+                stream.write(json.dumps(alarm.record, ensure_ascii=False) + '\n')
+            count += 1
+        return count
 
 
     @classmethod
@@ -54,53 +483,80 @@ class Alarm:
         ''' загрузить будильник по id
             :param aId: Номер будильника в базе
         '''
-        cursor = dbCon.cursor()
-        cursor.execute('select * from alarms where id = ?', (aId,))
+        cursor = app.db.reader().cursor()
+        cursor.execute(f'select {", ".join(cls.ALARM_COLUMNS)} from alarms where id = ?', (aId,))
         row = cursor.fetchone()
         cursor.close()
         if row is None:
             raise ValueError('Будильник не найден')
-        return cls(dict(zip(cls.ALARM_COLUMNS, row)))
+        return cls.fromRow(row)
 
     @classmethod
-    def ringerAlarms(cls, usedDbCon=None):
-        ''' Забрать будильники совпавшие с текущим временем
-            :param usedDbCon: используемое соединение для доступа к базе, Если пусто - используем соединение основного потока
-        '''
-        curTime = time.localtime()
-        ct = curTime.tm_hour * 60 + curTime.tm_min
-        dbCon2 = usedDbCon if usedDbCon else dbCon
-        cursor = dbCon2.cursor()
-        cursor.execute('select * from alarms where time = ?', (ct,))
+    def ringerAlarms(cls):
+        ''' Забрать будильники совпавшие с текущим временем '''
+        now = app.clock.now()
+        start = time.perf_counter()
+        cursor = app.db.reader().cursor()
+        # все условия проверяются в базе по индексу alarms_due
+        cursor.execute(
+            f'select {", ".join(cls.ALARM_COLUMNS)} from alarms where time = ? and (date is null or date = ?) and days & ? != 0',
+            (now.hour * 60 + now.minute, now.toordinal(), 1 << now.weekday(),)
+        )
         alarms = cursor.fetchall()
         cursor.close()
-        # dbCon2.close()
-        return tuple(filter(lambda a: a.available(), map(lambda el: cls( dict(zip(('id', 'time', 'cond'), el))), alarms)))
+        app.metrics.observe('alarm_ringer_query_seconds', time.perf_counter() - start)
+        return tuple(cls.fromRow(row) for row in alarms)
+
+
+    @classmethod
+    def condToColumns(cls, cond):
+        ''' словарь условий будильника -> значения колонок COND_COLUMNS '''
+        date = None
+        if 'date' in cond:
+            date = datetime.datetime.strptime(cond['date'], '%d.%m.%Y').toordinal()
+        days = cls.ALL_DAYS
+        if 'days' in cond:
+            days = sum(1 << cls.DAYS.index(d) for d in set(cond['days']) if d in cls.DAYS)
+        return (date, days, cond.get('count', 0), cond.get('interval', 0), cond.get('msg'), cond.get('soundId'),)
+
+
+    @classmethod
+    def columnsToCond(cls, date, days, rcount, rinterval, msg, soundId):
+        ''' значения колонок COND_COLUMNS -> словарь условий будильника '''
+        cond = {}
+        if date is not None:
+            cond['date'] = datetime.date.fromordinal(date).strftime('%d.%m.%Y')
+        elif days != cls.ALL_DAYS:
+            cond['days'] = [d for (i, d) in enumerate(cls.DAYS) if days & (1 << i)]
+        if rcount or rinterval:
+            cond.update({'count': rcount, 'interval': rinterval})
+        if msg:
+            cond['msg'] = msg
+        if soundId is not None:
+            cond['soundId'] = soundId
+        return cond
 
 
     @classmethod
-    def stopAll(self, usedDbCon=None):
-        ''' Остановка всех запущенных будильников ..
-            :param usedDbCon: Используемое соединнение с базой
-        '''
-        dbCon2 = usedDbCon if usedDbCon else dbCon
-        curs = dbCon2.cursor()
-        curs.execute('select id as aid, pid from alarms where pid > 0')
-        pids = curs.fetchall()
+    def stopAll(self):
+        ''' Остановка всех запущенных будильников .. '''
+        # только свои: плееры других экземпляров на той же базе не трогаем
+        pids = app.db.reader().execute(
+            'select id as aid, pid from alarms where pid > 0 and (owner = ? or owner is null)', (app.instanceId,)
+        ).fetchall()
         if not pids:
             return
         for (aid, pid,) in pids:
-            try:
-                os.kill(pid, signal.SIGINT)
-            except ProcessLookupError:
-                pass
-            curs.execute('update alarms set pid = null where id = ?', (aid,))
-        dbCon2.commit()
+            app.player.stop(pid)
+            app.record('stop', aid)
+        app.db.write('update alarms set pid = null, owner = null where id = ?', [(aid,) for (aid, _) in pids], many=True).result()
 
 
-    def available(self):
-        ''' проверка условий '''
-        curTime = time.localtime()
+    def available(self, moment=None):
+        ''' проверка условий
+            :param moment: проверяемый момент (datetime), если пусто - текущее время
+        '''
+        curTime = (moment or app.clock.now()).timetuple()
         # проверка по времени запуска... (первый запуск будильника)
         if self._time != curTime.tm_hour * 60 + curTime.tm_min:
             return False
@@ -113,14 +569,49 @@ class Alarm:
         return True
 
 
+    def nextFire(self, after):
+        ''' ближайший момент звонка строго после заданного
+            :param after: момент (datetime), после которого ищем звонок
+            :return: datetime или None, если будильник больше не зазвонит
+        '''
+        fireTime = datetime.time(self._time // 60, self._time % 60)
+        # будильник на конкретную дату
+        if 'date' in self._cond:
+            fireAt = datetime.datetime.combine(datetime.datetime.strptime(self._cond['date'], '%d.%m.%Y').date(), fireTime)
+            return fireAt if fireAt > after else None
+        # ближайшая неделя (+ сегодня) покрывает все варианты по дням недели
+        for shift in range(8):
+            fireAt = datetime.datetime.combine(after.date() + datetime.timedelta(days=shift), fireTime)
+            if fireAt <= after:
+                continue
+            if 'days' in self._cond and self.DAYS[fireAt.weekday()] not in self._cond['days']:
+                continue
+            return fireAt
+        return None
+
+
+    @classmethod
+    def fromRow(cls, row):
+        ''' будильник из строки таблицы с колонками ALARM_COLUMNS (без разбора условий) '''
+        alarm = cls.__new__(cls)
+        alarm._id, alarm._time, alarm._pid, alarm._owner = row[0], row[1], row[8], row[9]
+        alarm.__row, alarm.__cond, alarm.__hasErrors = row, None, False
+        return alarm
+
+
     def __init__(self, *args):
         ''' Инициализация объекта будильника '''
         self._id = None # номер будильника
         self._pid = None # номер приложения-звонилки ....
+        self._owner = None # экземпляр приложения, запустивший звонилку
+        self.__row = None # строка таблицы, из которой разбираются условия
+        self.__cond = None
+        self.__hasErrors = False
         # проверка на наличие в первом аргументе словаря - словарь - данные из базы
         if len(args) == 1 and isinstance(args[0], dict):
-            for k in args[0].keys():
-                setattr(self, '_' + k, json.loads(args[0][k]) if k == 'cond' else args[0][k])
+            row = args[0]
+            self._id, self._time, self._pid, self._owner = row.get('id'), row['time'], row.get('pid'), row.get('owner')
+            self._cond = self.columnsToCond(*(row.get(k) for k in self.COND_COLUMNS))
             return
 
         # создание нового объекта из исходных данных
@@ -152,7 +643,7 @@ class Alarm:
                 # с датой не получилось. пробуем разбить на части по запятой (вдруг это дни недели)
                 v = [v for v in re.split(r'\s*,\s*', when) if self.DAYS.count(v) > 0]
             else:
-                now = datetime.datetime.now()
+                now = app.clock.now()
                 alarm = datetime.datetime(int(v.group(3)), int(v.group(2)), int(v.group(1)), self._time // 60, self._time % 60)
                 sub = (alarm - now).total_seconds()
                 if sub <= 0:
@@ -177,9 +668,8 @@ class Alarm:
 
         # мелодия
         if soundNum and soundNum.isdigit():
-            soundNum = int(soundNum) - 1
-            if soundNum >= 0 and soundNum < len(soundFiles):
-                self._cond['soundN'] = soundNum
+            if app.sounds.path(app.db.reader(), int(soundNum)):
+                self._cond['soundId'] = int(soundNum)
 
 
     def save(self):
@@ -187,12 +677,9 @@ class Alarm:
         # Есть ошибки .. сохраняться не будем .
         if self.__hasErrors:
             return False
-        dataRow = (self._time, json.dumps(self._cond, ensure_ascii=False),)
-        cursor = dbCon.cursor()
-        cursor.execute('insert into alarms (time, cond) values(?, ?)', dataRow)
-        dbCon.commit()
-        self._id = cursor.lastrowid
-        cursor.close()
+        dataRow = (self._time, *self.condToColumns(self._cond),)
+        self._id = app.db.write(f'insert into alarms (time, {", ".join(self.COND_COLUMNS)}) values(?, ?, ?, ?, ?, ?, ?)', dataRow).result()
+        alarmsChanged.set()
         return True
 
 
@@ -202,58 +689,37 @@ class Alarm:
         if not self._id:
             return False
         self.stopDing()
-        cursor = dbCon.cursor()
-        cursor.execute('delete from alarms where id = ?', (self._id,))
-        dbCon.commit()
-        cursor.close()
+        app.db.write('delete from alarms where id = ?', (self._id,)).result()
+        alarmsChanged.set()
         return True
 
 
-    def __showMsg(self):
-        ''' Показываем сообщение '''
-        msgBox.showinfo(self, self._cond['msg'] if 'msg' in self._cond and self._cond['msg'] else  'Звоним!')
-
-    def startDing(self, dbThreadCon=None):
-        ''' запуск звонилки .. .для конкретного будильника
-            :param dbThreadCon: Используемое соединение с базой, если пусто - используем основной поток
-        '''
-        dbCon2 = dbThreadCon if dbThreadCon else dbCon
-        if self._pid: # будильник уже звонил на момент повтора  - надо остановить и сделать перезапуск
-            self.stopDing(dbCon2)
-
-        # print('ding', self._id, '!!')
-
-        playerApp = env.get('player', None)
-        soundTrack = env.get('sound', None)
-        if 'soundN' in self._cond and self._cond['soundN'] >= 0 and self._cond['soundN'] < len(soundFiles):
-            soundTrack = soundFiles[self._cond['soundN']].path
-
-        if playerApp and soundTrack:
-            proc = subprocess.Popen([playerApp, soundTrack, '--volume=30'], stdout=subprocess.DEVNULL)
-            self._pid = proc.pid
-            curs = dbCon2.cursor()
-            curs.execute('update alarms set pid = ? where id = ?', (self._pid, self._id,))
-            dbCon2.commit()
-            curs.close()
-            # показываем сообщение ...
-            threading.Thread(target=self.__showMsg).start()
+    @property
+    def message(self):
+        ''' текст сообщения будильника '''
+        return self._cond['msg'] if 'msg' in self._cond and self._cond['msg'] else  'Звоним!'
 
-    def stopDing(self, dbThreadCon=None):
+    @property
+    def soundTrack(self):
+        ''' мелодия будильника: своя из индекса мелодий или стандартная из настроек '''
+        soundTrack = app.env.get('sound', None)
+        if 'soundId' in self._cond:
+            soundTrack = SoundLibrary.path(app.db.reader(), self._cond['soundId']) or soundTrack
+        return soundTrack
+
+    def stopDing(self, wait=True):
         ''' остановка запущенного будильника
-            :param dbThreadCon: соединение с базой используемое в потоке
+            :param wait: дождаться записи состояния в базу
         '''
-        if self._pid is None:
+        if self._pid is None or self.isForeignRing:
             return False
 
-        try:
-            os.kill(self._pid, signal.SIGINT)
-        except ProcessLookupError:
-            pass
-        dbCon2 = dbThreadCon if dbThreadCon else dbCon
-        curs = dbCon2.cursor()
-        curs.execute('update alarms set pid = null where id = ?', (self._id,))
-        dbCon2.commit()
-        curs.close()
+        app.player.stop(self._pid)
+        app.record('stop', self._id)
+        written = app.db.write('update alarms set pid = null, owner = null where id = ? and (owner = ? or owner is null)',
+                               (self._id, app.instanceId))
+        if wait:
+            written.result()
         return True
 
 
@@ -272,6 +738,18 @@ class Alarm:
         return ' '.join(res) + ']'
 
 
+    @property
+    def _cond(self):
+        ''' условия будильника (из строки таблицы разбираются при первом обращении) '''
+        if self.__cond is None:
+            # в ALARM_COLUMNS колонки условий идут сразу за id и time
+            self.__cond = self.columnsToCond(*self.__row[2:8])
+        return self.__cond
+
+    @_cond.setter
+    def _cond(self, cond):
+        self.__cond = cond
+
     @property
     def id(self):
         ''' возвращаем id будильника '''
@@ -303,119 +781,801 @@ class Alarm:
             return (self._cond['count'], self._cond['interval'],)
         return None
 
+    @property
+    def record(self):
+        ''' будильник в виде записи для импорта / экспорта '''
+        return {
+            'time': self.time,
+            'when': self._cond['date'] if 'date' in self._cond else ','.join(self._cond['days']) if 'days' in self._cond else '-',
+            'repeat': '{}:{}'.format(*self.repeatsTuple) if self.repeatsTuple else '-',
+            'msg': self._cond.get('msg', ''),
+            'sound': self._cond.get('soundId', ''),
+        }
+
     @property
     def isRing(self):
         ''' будильник в активном режиме - звонит '''
         return self._pid is not None
 
+
+    @property
+    def isForeignRing(self):
+        ''' будильник звонит у другого экземпляра приложения (на той же базе) - остановить его можно только там '''
+        return self._pid is not None and self._owner not in (None, app.instanceId)
+
     @property
     def repeats(self):
         ''' число повторов в виде строки '''
         if 'count' in self._cond and 'interval' in self._cond:
-            return f'{self._cond['count']} через {self._cond['interval']} мин.'
+            return f'{self._cond["count"]} через {self._cond["interval"]} мин.'
         return '-'
 
 
 
-class AlarmClock:
-    ''' Класс управления будильниками '''
+class AlarmCache:
+    ''' Кэш будильников потока-звонилки: будильники по id и их условия в колонках (evaluator.AlarmTable).
+        Из базы подтягиваются только изменённые будильники (журнал alarmChanges),
+        а сама проверка "были ли изменения" - PRAGMA data_version без чтения таблиц
+    '''
+    # сколько секунд хранить записи журнала изменений
+    CHANGES_TTL = 24 * 60 * 60
+    # как часто (не чаще) чистить журнал изменений при сверках с базой, сек
+    CHANGES_PRUNE_INTERVAL = 60 * 60
 
-    # проверка будильников работает до тех пор пока тут True
-    __ringerAwailable = True
-    # Набор будильников с повторами ... (их нужно повторить )
-    __alarmsWithRepeat = {}
-    # содинение базы для потока проверяющего и запускающего будильники ..
-    __dbConnectionAlarmsCheckerThread = None
-
-
-    def __alarmRingerRepeatTodo(self):
-        ''' проверка и запуск повторов будильников  '''
-        curTime = time.localtime()
-        curTime = curTime.tm_hour*60 + curTime.tm_min
-        toDel = []
-        # пробегаем по повторам ..
-        for aId in filter(lambda ark: curTime in self.__alarmsWithRepeat[ark]['times'], self.__alarmsWithRepeat):
-            self.__alarmsWithRepeat[aId]['alarm'].startDing(self.__dbConnectionAlarmsCheckerThread)
-            self.__alarmsWithRepeat[aId]['times'].pop(0)
-            # Повторы закончились ... пемечаем для удаления
-            if len(self.__alarmsWithRepeat[aId]['times']) == 0:
-                toDel.append(aId)
-        for aId in toDel:
-            del self.__alarmsWithRepeat[aId]
-
-
-    def __alarmRingerFirstRinger(self, alarm):
+
+    def __init__(self):
+        # соединение для чтения потока-владельца кэша
+        self.__dbCon = app.db.reader()
+        self.__dataVersion = None
+        # последняя учтённая запись журнала изменений
+        self.__lastSeq = 0
+        # момент (time.monotonic) следующей чистки журнала изменений
+        self.__pruneAt = 0
+        # будильники по id
+        self.alarms = {}
+        # условия будильников по id в колонках evaluator.COLUMNS и собранная из них таблица
+        self.__columns = {}
+        self.__table = None
+
+
+    def __put(self, row):
+        alarm = Alarm.fromRow(row)
+        self.__drop(alarm.id)
+        self.alarms[alarm.id] = alarm
+        # ALARM_COLUMNS начинаются с колонок условий evaluator.COLUMNS
+        self.__columns[alarm.id] = row[:6]
+
+
+    def __drop(self, aId):
+        self.__columns.pop(aId, None)
+        self.alarms.pop(aId, None)
+
+
+    def __load(self, changes=None):
+        ''' загрузка будильников из базы
+            :param changes: (после какой, по какую запись журнала изменений) - загрузить изменённые будильники, None - все
+        '''
+        cursor = self.__dbCon.cursor()
+        if changes is None:
+            cursor.execute(f'select {", ".join(Alarm.ALARM_COLUMNS)} from alarms')
+        else:
+            # id берутся подзапросом: изменённых может быть больше, чем допустимо параметров запроса
+            cursor.execute(
+                f'select {", ".join(Alarm.ALARM_COLUMNS)} from alarms where id in (select aid from alarmChanges where seq > ? and seq <= ?)',
+                changes
+            )
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+
+    def refresh(self):
+        ''' подтягиваем изменения из базы
+            :return: множество id изменённых (добавленных/удалённых) будильников
+        '''
+        # журнал растёт с каждой правкой - чистим и при сверках долго работающего приложения
+        if self.__dataVersion is not None and time.monotonic() >= self.__pruneAt:
+            self.__pruneChanges()
+        version = self.__dbCon.execute('pragma data_version').fetchone()[0]
+        if version == self.__dataVersion:
+            return set()
+        fullReload = self.__dataVersion is None
+        self.__dataVersion = version
+        (minSeq, maxSeq,) = self.__dbCon.execute('select min(seq), max(seq) from alarmChanges').fetchone()
+        # журнал вычищен целиком: номера записей (autoincrement) продолжатся после уже учтённых
+        maxSeq = maxSeq or self.__lastSeq
+        # первый запуск или журнал уже почищен дальше того, что мы видели - полная перезагрузка
+        if fullReload or (minSeq and minSeq > self.__lastSeq + 1):
+            changed = set(self.alarms)
+            self.alarms, self.__columns, self.__table = {}, {}, None
+            for row in self.__load():
+                self.__put(row)
+            self.__lastSeq = maxSeq
+            self.__pruneChanges()
+            return changed | set(self.alarms)
+        if maxSeq == self.__lastSeq:
+            return set()
+        changes = (self.__lastSeq, maxSeq,)
+        changed = {aId for (aId,) in self.__dbCon.execute('select aid from alarmChanges where seq > ? and seq <= ?', changes)}
+        self.__lastSeq = maxSeq
+        self.__table = None
+        for aId in changed:
+            self.__drop(aId)
+        for row in self.__load(changes):
+            self.__put(row)
+        return changed
+
+
+    def __pruneChanges(self):
+        ''' чистка устаревших (и уже учтённых кэшем) записей журнала изменений '''
+        self.__pruneAt = time.monotonic() + self.CHANGES_PRUNE_INTERVAL
+        app.db.write(
+            "delete from alarmChanges where ts < cast(strftime('%s', 'now') as integer) - ? and seq <= ?",
+            (self.CHANGES_TTL, self.__lastSeq,)
+        )
+
+
+    @property
+    def table(self):
+        ''' условия всех будильников кэша в колонках (evaluator.AlarmTable), пересобирается после изменений '''
+        if self.__table is None:
+            self.__table = AlarmTable(self.__columns.values(), None if app.env.get('evaluator') != 'array' else False)
+        return self.__table
+
+
+    def dueBetween(self, start, end):
+        ''' первые звонки будильников в интервале [start, end) любой длины
+            :return: отсортированный список (будильник, момент звонка)
+        '''
+        due = []
+        while start < end:
+            chunkEnd = min(start + datetime.timedelta(days=1), end)
+            due.extend((self.alarms[aId], fireAt,) for (fireAt, aId) in self.table.dueBetween(start, chunkEnd))
+            start = chunkEnd
+        return due
+
+
+
+class AlarmClaims:
+    ''' Захват звонков: каждый звонок (будильник, момент) звонит только у одного экземпляра
+        приложения из работающих на одной базе. Захват - условный upsert в таблицу claims
+        с арендой; звонок, захват которого истёк не отзвонив (экземпляр упал), может перехватить другой
+    '''
+    # сколько секунд хранить записи о звонках
+    CLAIMS_TTL = 24 * 60 * 60
+    # аренда захвата по умолчанию (claimLease), сек
+    LEASE = 30
+
+
+    def __init__(self):
+        self.__lease = int(app.env.get('claimLease') or self.LEASE)
+
+
+    def claim(self, batch, now):
+        ''' захват звонков одной транзакцией
+            :param batch: список (будильник, момент звонка)
+            :param now: текущий момент
+            :return: (захваченные (будильник, момент), чужие (будильник, момент, до какого момента аренда))
+        '''
+        owner, nowTs = app.instanceId, int(now.timestamp())
+
+        def write(con):
+            mine, others = [], []
+            for (alarm, fireAt) in batch:
+                fireTs = int(fireAt.timestamp())
+                cursor = con.execute(
+                    '''insert into claims (aid, fireAt, owner, leaseUntil) values (?, ?, ?, ?)
+                    on conflict (aid, fireAt) do update set owner = excluded.owner, leaseUntil = excluded.leaseUntil
+                    where claims.done = 0 and (claims.leaseUntil < ? or claims.owner = excluded.owner)''',
+                    (alarm.id, fireTs, owner, nowTs + self.__lease, nowTs,)
+                )
+                if cursor.rowcount:
+                    mine.append((alarm, fireAt,))
+                    continue
+                (leaseUntil, done) = con.execute('select leaseUntil, done from claims where aid = ? and fireAt = ?', (alarm.id, fireTs,)).fetchone()
+                # уже отзвонил другой экземпляр - забываем
+                if not done:
+                    others.append((alarm, fireAt, datetime.datetime.fromtimestamp(leaseUntil + 1),))
+            con.execute('delete from claims where fireAt < ?', (nowTs - self.CLAIMS_TTL,))
+            return (mine, others)
+        return app.db.call(write).result()
+
+
+    def done(self, batch):
+        ''' звонки отзвонили - больше их никто не перехватит
+            :param batch: список (будильник, момент звонка)
+        '''
+        app.db.write(
+            'update claims set done = 1 where aid = ? and fireAt = ? and owner = ?',
+            [(alarm.id, int(fireAt.timestamp()), app.instanceId,) for (alarm, fireAt) in batch], many=True
+        )
+
+
+
+class AlarmRinger:
+    ''' Запуск всех звонков одного тика. Будильники одного момента с одной мелодией играют
+        одним процессом плеера, плееры запускаются пулом потоков ограниченного размера,
+        а сообщения всех прозвеневших будильников показываются одним уведомлением.
+        Звонок снимается (в базе - одной записью на пачку), когда плеер доиграл или звонит дольше maxRingSeconds
+    '''
+    # сколько плееров запускать одновременно, если не задано в настройках (ringConcurrency)
+    CONCURRENCY = 4
+    # сколько секунд может длиться звонок, если не задано в настройках (maxRingSeconds, 0 - без ограничения)
+    MAX_RING = 10 * 60
+
+
+    def __init__(self):
+        self.__pool = None
+        self.__log = logging.getLogger('alarmClock')
+        # задержки звонков последнего тика: (id будильника, сек)
+        self.lastLags = []
+        # звонящие плееры: pid -> [момент, когда звонок пора снять (None - без ограничения), будильники]
+        self.__ringing = {}
+        # куча (момент, когда звонок пора снять, pid)
+        self.__deadlines = []
+        # состояние звонящих плееров меняют и звонки тика, и поток, забирающий завершившиеся плееры
+        self.__lock = threading.Lock()
+
+
+    def __restarts(self, alarms):
+        ''' будильники, которые уже звонили на момент повтора, перезапускаются
+            :return: pid плееров, которые надо остановить - общий плеер останавливаем,
+                только если перезапускаются все звонящие на нём будильники
+        '''
+        restarting = {alarm.id for alarm in alarms if alarm._pid}
+        pids = set()
+        for alarm in alarms:
+            if not alarm._pid or alarm.isForeignRing:
+                continue
+            app.record('stop', alarm.id, reason='restart')
+            (_, ringing) = self.__ringing.get(alarm._pid, (None, ()))
+            if all(other.id in restarting for other in ringing if other._pid == alarm._pid):
+                pids.add(alarm._pid)
+        return pids
+
+
+    def __play(self, soundTrack, alarms):
+        ''' одна мелодия на группу будильников (выполняется в пуле)
+            :return: (pid плеера, момент запуска)
+        '''
+        start = time.perf_counter()
+        pid = app.player.play(soundTrack)
+        app.metrics.observe('alarm_player_spawn_seconds', time.perf_counter() - start)
+        return (pid, app.clock.now(),)
+
+
+    def __notify(self, alarms):
+        ''' одно сообщение на все будильники тика '''
+        if len(alarms) == 1:
+            app.notify(str(alarms[0]), alarms[0].message)
+        else:
+            app.notify(f'Будильники: {len(alarms)}', '\n'.join(f'{alarm}: {alarm.message}' for alarm in alarms))
+
+
+    def ring(self, batch):
+        ''' запуск звонков
+            :param batch: список (будильник, момент, на который был назначен звонок)
+            :return: список (id будильника, задержка звонка в секундах)
+        '''
+        if self.__pool is None:
+            workers = int(app.env.get('ringConcurrency') or self.CONCURRENCY)
+            self.__pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='ringer')
+            app.player.onExit = self.__exited
+        playerApp = app.env.get('player', None)
+        maxRing = int(app.env.get('maxRingSeconds') or self.MAX_RING)
+        metrics = app.metrics
+        # (момент, мелодия) -> будильники; один будильник за тик звонит один раз
+        groups = {}
+        seen = set()
+        for (alarm, fireAt) in batch:
+            if alarm.id in seen:
+                continue
+            seen.add(alarm.id)
+            soundTrack = alarm.soundTrack
+            if playerApp and soundTrack:
+                groups.setdefault((fireAt, soundTrack), []).append(alarm)
+        with self.__lock:
+            restarts = self.__restarts([alarm for alarms in groups.values() for alarm in alarms])
+        for pid in restarts:
+            app.player.stop(pid)
+        started = {key: self.__pool.submit(self.__play, key[1], alarms) for (key, alarms) in groups.items()}
+
+        rang, pids, lags = [], [], []
+        # плеер, доигравший раньше, чем звонок записан, снимается после этой записи
+        with self.__lock:
+            for (key, alarms) in groups.items():
+                fireAt = key[0]
+                try:
+                    (pid, startedAt) = started[key].result()
+                except OSError as e:
+                    self.__log.error('не удалось запустить плеер: %s', e)
+                    continue
+                for alarm in alarms:
+                    (alarm._pid, alarm._owner) = (pid, app.instanceId)
+                    pids.append((pid, app.instanceId, alarm.id,))
+                    lag = (startedAt - fireAt).total_seconds()
+                    lags.append((alarm.id, lag,))
+                    metrics.observe('alarm_fire_lag_seconds', lag)
+                    self.__log.info('будильник #%s: задержка звонка %.3f с', alarm.id, lag)
+                # тёплый плеер (playerMode=ipc) играет все звонки одним процессом
+                ringing = self.__ringing.setdefault(pid, [None, []])
+                ringing[1].extend(alarms)
+                if maxRing > 0:
+                    ringing[0] = startedAt + datetime.timedelta(seconds=maxRing)
+                    heapq.heappush(self.__deadlines, (ringing[0], pid,))
+                rang.extend(alarms)
+            if pids:
+                # состояние всех звонков тика - одной записью
+                app.db.write('update alarms set pid = ?, owner = ? where id = ?', pids, many=True)
+        if rang:
+            threading.Thread(target=self.__notify, args=(rang,), daemon=True).start()
+        self.lastLags = lags
+        return lags
+
+
+    def __release(self, pids, reason):
+        ''' звонки плееров pids закончились: снимаем отметку звонка (одной записью)
+            :param reason: причина для журнала событий (finished - доиграл, timeout - звонил дольше maxRingSeconds)
+        '''
+        cleared = []
+        for pid in pids:
+            (_, alarms) = self.__ringing.pop(pid, (None, ()))
+            for alarm in alarms:
+                # будильник мог зазвонить заново другим плеером
+                if alarm._pid == pid:
+                    (alarm._pid, alarm._owner) = (None, None)
+                    cleared.append((alarm.id, pid,))
+                    app.record('stop', alarm.id, reason=reason)
+        if cleared:
+            app.db.write('update alarms set pid = null, owner = null where id = ? and pid = ?', cleared, many=True)
+
+
+    def __exited(self, pids):
+        ''' плееры доиграли (вызывается потоком, который забирает завершившиеся плееры) '''
+        with self.__lock:
+            self.__release(pids, 'finished')
+
+
+    def __skipStale(self):
+        ''' убираем из кучи моменты снятия звонков, которые уже сняты или перезапущены '''
+        while self.__deadlines:
+            (deadline, pid) = self.__deadlines[0]
+            ringing = self.__ringing.get(pid)
+            if ringing is not None and ringing[0] == deadline:
+                return
+            heapq.heappop(self.__deadlines)
+
+
+    def expire(self, now):
+        ''' остановка звонков, которые звонят дольше maxRingSeconds
+            :param now: текущий момент
+        '''
+        with self.__lock:
+            expired = []
+            self.__skipStale()
+            while self.__deadlines and self.__deadlines[0][0] <= now:
+                (_, pid) = heapq.heappop(self.__deadlines)
+                expired.append(pid)
+                self.__skipStale()
+            for pid in expired:
+                app.player.stop(pid)
+            self.__release(expired, 'timeout')
+
+
+    @property
+    def nextExpire(self):
+        ''' ближайший момент снятия звонка (None - снимать нечего) '''
+        with self.__lock:
+            self.__skipStale()
+            return self.__deadlines[0][0] if self.__deadlines else None
+
+
+    def close(self):
+        ''' остановка пула '''
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=True)
+            self.__pool = None
+            app.player.onExit = None
+
+
+
+class AlarmScheduler:
+    ''' Планировщик звонков: держит ближайшие моменты срабатывания будильников и их повторов в кучах
+        и спит до самого раннего из них (без ежесекундного опроса базы). Звонки, пропущенные пока планировщик
+        стоял или приложение не работало, догоняются (после водяного знака, в пределах окна опоздания)
+    '''
+    # максимальный сон без проверки (защита от перевода системных часов)
+    MAX_SLEEP = 15 * 60
+    # с какого числа изменённых будильников перепланировать все сразу через evaluator.AlarmTable
+    TABLE_RESCHEDULE = 1000
+    # насколько звонок может опоздать (планировщик стоял: база занята, пауза ВМ, сон), если не задано
+    # в настройках (fireGraceSeconds), сек; опоздавшие сильнее не звонят, а пишутся в журнал как missed
+    GRACE = 60 * 60
+    # ключ в таблице meta: момент, по который (включительно) звонки уже обработаны
+    WATERMARK_KEY = 'firedThrough'
+    # за сколько (до окна опоздания) записывать в журнал звонки, пропущенные пока приложение не работало
+    MISSED_AUDIT = datetime.timedelta(days=1)
+    # пауза перед повтором тика после ошибки, сек (удваивается до ERROR_BACKOFF_MAX, пока ошибки идут подряд)
+    ERROR_BACKOFF = 1
+    ERROR_BACKOFF_MAX = 60
+
+
+    def __init__(self):
+        # проверка будильников работает до тех пор пока тут True
+        self.__ringerAwailable = True
+        # сигнал остановки (прерывает паузу после ошибки тика)
+        self.__stopped = threading.Event()
+        # кэш будильников
+        self.__cache = None
+        # куча (момент звонка, id будильника)
+        self.__heap = []
+        # актуальный момент следующего звонка по id будильника (устаревшие записи кучи пропускаются)
+        self.__nextFires = {}
+        # ожидающие повторы: id будильника -> (момент повтора, осталось повторов, интервал в минутах)
+        self.__repeats = {}
+        # куча повторов (момент повтора, id будильника)
+        self.__repeatHeap = []
+        # момент следующей сверки с базой
+        self.__nextPoll = None
+        # звонки текущего тика: (будильник, момент звонка) - запускаются разом через AlarmRinger
+        self.__due = []
+        # какие из звонков тика - повторы: (id будильника, момент)
+        self.__dueRepeats = set()
+        self.__ringer = AlarmRinger()
+        # захват звонков (несколько экземпляров на одной базе)
+        self.__claims = None
+        # куча звонков, захваченных другими экземплярами: (конец аренды, id будильника, момент звонка)
+        self.__claimHeap = []
+        # окно опоздания звонков
+        self.__grace = datetime.timedelta(seconds=int(app.env.get('fireGraceSeconds') or self.GRACE))
+        # записи журнала звонков за тик: (id будильника, момент звонка, момент запуска плеера, вид, экземпляр)
+        self.__firings = []
+        # сколько звонков за тик пропущено из-за опоздания
+        self.__missed = 0
+
+
+    def __schedule(self, aId, after):
+        ''' планируем следующий звонок будильника
+            :param aId: id будильника
+            :param after: момент, строго после которого ищем звонок
+        '''
+        alarm = self.__cache.alarms.get(aId)
+        fireAt = alarm.nextFire(after) if alarm else None
+        if fireAt is None:
+            self.__nextFires.pop(aId, None)
+            return
+        self.__nextFires[aId] = fireAt
+        heapq.heappush(self.__heap, (fireAt, aId))
+
+
+    def __refresh(self, now):
+        ''' подтягиваем изменения будильников и перепланируем только изменённые
+            :param now: текущий момент
+        '''
+        start = time.perf_counter()
+        changed = self.__cache.refresh()
+        app.metrics.observe('alarm_cache_refresh_seconds', time.perf_counter() - start)
+        if len(changed) > self.TABLE_RESCHEDULE and len(changed) >= len(self.__cache.alarms):
+            # перезагружен весь кэш - ближайшие звонки всех будильников одним проходом по колонкам
+            self.__nextFires = dict(self.__cache.table.nextFires(now))
+            self.__heap = [(fireAt, aId) for (aId, fireAt) in self.__nextFires.items()]
+            heapq.heapify(self.__heap)
+        else:
+            for aId in changed:
+                self.__schedule(aId, now)
+        # устаревших записей в куче слишком много - пересобираем
+        if len(self.__heap) > 2 * len(self.__nextFires) + 64:
+            self.__heap = [(fireAt, aId) for (aId, fireAt) in self.__nextFires.items()]
+            heapq.heapify(self.__heap)
+        # как часто (сек) сверяться с базой на предмет изменений из других соединений/процессов
+        self.__nextPoll = now + datetime.timedelta(seconds=int(app.env.get('dbPollInterval', 60)))
+
+
+    def __setRepeat(self, aId, fireAt, left, interval):
+        ''' запоминаем (в памяти и в базе) очередной повтор будильника
+            :param aId: id будильника
+            :param fireAt: момент повтора
+            :param left: сколько повторов осталось (включая этот)
+            :param interval: интервал между повторами, мин
+        '''
+        self.__repeats[aId] = (fireAt, left, interval,)
+        heapq.heappush(self.__repeatHeap, (fireAt, aId))
+        app.db.write(
+            'insert or replace into repeats (aid, fireAt, left, interval) values (?, ?, ?, ?)',
+            (aId, int(fireAt.timestamp()), left, interval,)
+        )
+
+
+    def __dropRepeat(self, aId):
+        ''' повторы будильника закончились '''
+        self.__repeats.pop(aId, None)
+        app.db.write('delete from repeats where aid = ?', (aId,))
+
+
+    def __loadRepeats(self, now):
+        ''' восстановление ожидающих повторов из базы (после перезапуска)
+            :param now: текущий момент
+        '''
+        self.__repeats, self.__repeatHeap = {}, []
+        rows = app.db.reader().execute('select aid, fireAt, left, interval from repeats').fetchall()
+        for (aId, fireAt, left, interval,) in rows:
+            fireAt = datetime.datetime.fromtimestamp(fireAt)
+            # повторы, пропущенные пока приложение не работало, догоняем только в пределах окна опоздания
+            while left > 0 and fireAt < now - self.__grace:
+                fireAt += datetime.timedelta(minutes=interval)
+                left -= 1
+            if left > 0 and aId in self.__cache.alarms:
+                self.__setRepeat(aId, fireAt, left, interval)
+            else:
+                self.__dropRepeat(aId)
+
+
+    def __alarmRingerRepeatTodo(self, now):
+        ''' запуск наступивших повторов будильников (только тех, что уже пора звонить)
+            :param now: текущий момент
+        '''
+        while self.__repeatHeap and self.__repeatHeap[0][0] <= now:
+            fireAt, aId = heapq.heappop(self.__repeatHeap)
+            repeat = self.__repeats.get(aId)
+            # запись устарела (будильник успел зазвонить заново)
+            if repeat is None or repeat[0] != fireAt:
+                continue
+            alarm = self.__cache.alarms.get(aId)
+            # будильник удалили
+            if alarm is None:
+                self.__dropRepeat(aId)
+                continue
+            if not self.__tooLate(aId, fireAt, now):
+                self.__due.append((alarm, fireAt,))
+                self.__dueRepeats.add((aId, fireAt,))
+            (_, left, interval,) = repeat
+            # Повторы закончились ... удаляем
+            if left > 1:
+                self.__setRepeat(aId, fireAt + datetime.timedelta(minutes=interval), left - 1, interval)
+            else:
+                self.__dropRepeat(aId)
+
+
+    def __tooLate(self, aId, fireAt, now):
+        ''' звонок опоздал больше окна опоздания - не звоним, а пишем в журнал звонков как пропущенный '''
+        if now - fireAt <= self.__grace:
+            return False
+        self.__firings.append((aId, int(fireAt.timestamp()), None, 'missed', app.instanceId,))
+        self.__missed += 1
+        return True
+
+
+    def __alarmRingerFirstRinger(self, alarm, fireAt):
         ''' заполнение повторов - первый запуск будильника
             :param alarm: объект запущенного будильника
+            :param fireAt: момент, на который был назначен звонок
         '''
-        # Включаем звонилку ...
-        alarm.startDing(self.__dbConnectionAlarmsCheckerThread)
-        # alarmDinger = threading.Thread(target=self.__soundRinger)
-        #     alarmDinger.start()
+        # Включаем звонилку ... (в общей пачке тика)
+        self.__due.append((alarm, fireAt,))
 
         # Запрос повторов у будильника
         reps = alarm.repeatsTuple
         # нет повторов
-        if not reps:
+        if not reps or reps[0] <= 0:
             return
+        self.__setRepeat(alarm.id, fireAt + datetime.timedelta(minutes=reps[1]), reps[0], reps[1])
 
-        # на всякий пожарный запихаем сам будильник
-        self.__alarmsWithRepeat[alarm.id] = {'alarm': alarm, 'times': [alarm.timeAsDiget]}
-        # собираем времена повторов
-        for t in range(reps[0]):
-            nt = self.__alarmsWithRepeat[alarm.id]['times'][-1] + reps[1]
-            # перенос через сутки
-            nt = nt if nt < 24 * 60 else nt % (24 * 60)
-            self.__alarmsWithRepeat[alarm.id]['times'].append(nt)
-        # выкинуть то что уже случилось
-        self.__alarmsWithRepeat[alarm.id]['times'].pop(0)
-
-
-    def __alarmRinger(self, sStart = None):
-        ''' проверяем состояния будильников ..
-            :param sStart: Секунда реального времени на которой был запуск
-        '''
-        self.__dbConnectionAlarmsCheckerThread = sqlite3.connect(env.get('dbFile', 'ac.db'))
-        # просто счётчик
-        s = sStart if sStart else 0
-        # будильники с повтором
-        self.__alarmsWithRepeat = {}
-        # сразу проверяем будильники ... вдруг кто всплыл
-        alarms = Alarm.ringerAlarms(self.__dbConnectionAlarmsCheckerThread)
-        # по всем найденным - собираем повторы (если есть)
-        for alarm in alarms:
-            self.__alarmRingerFirstRinger(alarm)
 
-        ''' звонилка для будильника . '''
+    def __fireDue(self, now):
+        ''' запуск всех будильников, момент звонка которых наступил
+            :param now: текущий момент
+        '''
+        while self.__heap and self.__heap[0][0] <= now:
+            fireAt, aId = heapq.heappop(self.__heap)
+            # запись устарела (будильник изменён или удалён)
+            if self.__nextFires.get(aId) != fireAt:
+                continue
+            if not self.__tooLate(aId, fireAt, now):
+                self.__alarmRingerFirstRinger(self.__cache.alarms[aId], fireAt)
+            # следующий звонок этого же будильника
+            self.__schedule(aId, fireAt)
+
+
+    def __claimRetryTodo(self, now):
+        ''' звонки других экземпляров, аренда которых истекла: если не отзвонили - перехватываем
+            :param now: текущий момент
+        '''
+        while self.__claimHeap and self.__claimHeap[0][0] <= now:
+            (_, aId, fireAt) = heapq.heappop(self.__claimHeap)
+            alarm = self.__cache.alarms.get(aId)
+            if alarm is not None and not self.__tooLate(aId, fireAt, now):
+                self.__due.append((alarm, fireAt,))
+
+
+    def __ring(self):
+        ''' запуск накопленных за тик звонков (только захваченных этим экземпляром)
+            :return: задержки звонков (id будильника, сек)
+        '''
+        if not self.__due:
+            return []
+        (due, self.__due) = (self.__due, [])
+        (repeats, self.__dueRepeats) = (self.__dueRepeats, set())
+        try:
+            (mine, others) = self.__claims.claim(due, app.clock.now())
+        except Exception:
+            # база недоступна - звонки тика остаются ждать повтора тика
+            self.__due[:0] = due
+            self.__dueRepeats |= repeats
+            raise
+        for (alarm, fireAt, leaseUntil) in others:
+            heapq.heappush(self.__claimHeap, (leaseUntil, alarm.id, fireAt,))
+        lags = self.__ringer.ring(mine)
+        self.__claims.done(mine)
+        lagById = dict(lags)
+        for (alarm, fireAt) in mine:
+            kind = 'repeat' if (alarm.id, fireAt) in repeats else 'ring'
+            lag = lagById.get(alarm.id)
+            # без момента запуска - плеер не запустился (или мелодия не задана)
+            firedAt = fireAt.timestamp() + lag if lag is not None else None
+            self.__firings.append((alarm.id, int(fireAt.timestamp()), firedAt, kind, app.instanceId,))
+            if lag is not None:
+                app.record(kind, alarm.id, fireAt=fireAt, lag=lag)
+        return lags
+
+
+    def __catchUp(self, now):
+        ''' звонки, назначенные после водяного знака и не позже now (пропущенные, пока планировщик не работал):
+            в пределах окна опоздания звоним, более ранние (не дальше MISSED_AUDIT) пишем в журнал как пропущенные;
+            без водяного знака (первый запуск) - только текущая минута
+            :param now: текущий момент
+        '''
+        start = now.replace(second=0, microsecond=0)
+        row = app.db.reader().execute('select value from meta where key = ?', (self.WATERMARK_KEY,)).fetchone()
+        if row is not None:
+            # звонки в момент водяного знака уже обработаны
+            start = max(datetime.datetime.fromtimestamp(float(row[0])) + datetime.timedelta(microseconds=1), now - self.__grace - self.MISSED_AUDIT)
+        for (alarm, fireAt) in self.__cache.dueBetween(start, now.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)):
+            if not self.__tooLate(alarm.id, fireAt, now):
+                self.__alarmRingerFirstRinger(alarm, fireAt)
+
+
+    def __commitTick(self, now):
+        ''' конец тика: журнал звонков и водяной знак - звонки по now включительно обработаны '''
+        if self.__missed:
+            logging.getLogger('alarmClock').warning('пропущено звонков (опоздание больше %s): %d', self.__grace, self.__missed)
+            self.__missed = 0
+        if self.__firings:
+            (firings, self.__firings) = (self.__firings, [])
+            app.db.write('insert into firings (aid, fireAt, firedAt, kind, owner) values (?, ?, ?, ?, ?)', firings, many=True)
+        # водяной знак общий для экземпляров на одной базе - только вперёд
+        app.db.write(
+            '''insert into meta (key, value) values (?, ?)
+            on conflict (key) do update set value = excluded.value where cast(meta.value as real) < cast(excluded.value as real)''',
+            (self.WATERMARK_KEY, str(now.timestamp()),)
+        )
+
+
+    def __nextWake(self, now):
+        ''' момент, до которого можно спать '''
+        wake = min(now + datetime.timedelta(seconds=self.MAX_SLEEP), self.__nextPoll)
+        if self.__heap:
+            wake = min(wake, self.__heap[0][0])
+        if self.__repeatHeap:
+            wake = min(wake, self.__repeatHeap[0][0])
+        if self.__claimHeap:
+            wake = min(wake, self.__claimHeap[0][0])
+        expire = self.__ringer.nextExpire
+        if expire is not None:
+            wake = min(wake, expire)
+        return wake
+
+
+    def __startup(self, now):
+        ''' первый тик: загрузка будильников и повторов, звонки, пропущенные с прошлого запуска
+            :return: задержки звонков
+        '''
+        self.__refresh(now)
+        self.__loadRepeats(now)
+        # сразу звоним всё, что пропущено с прошлого запуска (и текущую минуту ... вдруг кто всплыл)
+        self.__catchUp(now)
+        self.__alarmRingerRepeatTodo(now)
+        lags = self.__ring()
+        self.__commitTick(now)
+        return lags
+
+
+    def __tick(self, now):
+        ''' один тик планировщика
+            :return: (была ли сверка с базой, задержки звонков)
+        '''
+        # набор будильников изменился (или пора свериться с базой) - перепланируем изменённые
+        refreshed = alarmsChanged.is_set() or now >= self.__nextPoll
+        if refreshed:
+            alarmsChanged.clear()
+        # наступившие повторы
+        self.__alarmRingerRepeatTodo(now)
+        # ищем будильники, время которых наступило (певый звонок); до сверки с базой, иначе звонок,
+        # назначенный на время остановки планировщика, перепланируется после now и теряется
+        self.__fireDue(now)
+        if refreshed:
+            try:
+                self.__refresh(now)
+            except Exception:
+                # сверка повторится вместе с тиком
+                alarmsChanged.set()
+                raise
+        # чужие звонки с истёкшей арендой
+        self.__claimRetryTodo(now)
+        lags = self.__ring()
+        self.__commitTick(now)
+        # звонки дольше maxRingSeconds
+        self.__ringer.expire(now)
+        return (refreshed, lags)
+
+
+    def run(self):
+        ''' цикл потока звонилки '''
+        self.__cache = AlarmCache()
+        self.__claims = AlarmClaims()
+        self.__heap, self.__nextFires, self.__claimHeap = [], {}, []
+        alarmsChanged.clear()
+        metrics = app.metrics
+        metrics.gauge('alarm_repeat_queue_depth', lambda: len(self.__repeats))
+        clock = app.clock
+        log = logging.getLogger('alarmClock')
+        # журнал каждого тика (traceTicks=1)
+        trace = log if app.traceTicks else None
+        (started, backoff) = (False, 0)
+
         while self.__ringerAwailable:
-            time.sleep(1)
-            # на  первой секунде каждой минуты ...
-            if s == 1:
-                self.__alarmRingerRepeatTodo()
-
-                # ищем будильники совпавшие по всем параметрам (певый звонок)
-                alarms = Alarm.ringerAlarms(self.__dbConnectionAlarmsCheckerThread)
-                # по всем найденным - собираем повторы (если есть)
-                for alarm in alarms:
-                    self.__alarmRingerFirstRinger(alarm)
-            s += 1
-            if s > 59:
-                s = 0
+            now = clock.now()
+            start = time.perf_counter()
+            try:
+                if not started:
+                    (started, refreshed, lags) = (True, True, self.__startup(now))
+                else:
+                    (refreshed, lags) = self.__tick(now)
+                backoff = 0
+            except Exception:
+                # ошибка тика (база занята, плеер, сверка с базой) не останавливает звонилку: повторяем тик позже
+                backoff = min(max(backoff * 2, self.ERROR_BACKOFF), self.ERROR_BACKOFF_MAX)
+                log.exception('ошибка тика планировщика, повтор через %s с', backoff)
+                clock.wait(self.__stopped, backoff)
+                continue
+            elapsed = time.perf_counter() - start
+            metrics.observe('alarm_tick_seconds', elapsed)
+            metrics.tick()
+            if trace:
+                trace.info(
+                    'тик %s: %.1f мс, сверка с базой: %s, звонков: %d, макс. задержка: %.3f с, повторов в очереди: %d',
+                    now.strftime('%H:%M:%S'), elapsed * 1000, 'да' if refreshed else 'нет', len(lags),
+                    max((lag for (_, lag) in lags), default=0), len(self.__repeats)
+                )
+            # спим до ближайшего события или до изменения набора будильников
+            timeout = (self.__nextWake(now) - clock.now()).total_seconds()
+            if timeout > 0:
+                clock.wait(alarmsChanged, timeout)
 
         # Остановка запущенных будильников ...
-        Alarm.stopAll(self.__dbConnectionAlarmsCheckerThread)
-        # signal.SIGTERM
-        self.__dbConnectionAlarmsCheckerThread.close()
+        self.__ringer.close()
+        Alarm.stopAll()
 
 
-    def __init__(self):
-        ''' главный цикл приложения '''
+    def stop(self):
+        ''' остановка цикла звонилки '''
+        self.__ringerAwailable = False
+        self.__stopped.set()
+        alarmsChanged.set()
+
+
+
+class AlarmRepl(abc.ABC):
+    ''' Консоль команд _todo* (общая для будильника и клиента демона будильников) '''
+    # сколько мелодий показывать в результатах поиска при выборе мелодии
+    SOUND_PICK_LIMIT = 20
+    # строк на странице списка будильников
+    LIST_PAGE = 50
+    # строк за один запрос при потоковом выводе списка (list plain)
+    LIST_CHUNK = 1000
+
+    def _repl(self):
+        ''' цикл опроса пользователя '''
         print('Для справки введите "help"\nвыход - пустая команда')
-        t = time.localtime();
-        # запуск потока опроса базы на наличие подходящих будильников
-        self.__ringer = threading.Thread(target = self.__alarmRinger, args = (t.tm_sec,))
-        self.__ringer.start()
-        # цикл опроса прользователя
         while True:
             cmd = input('Введите команду: ').strip()
             if not cmd:
@@ -430,9 +1590,9 @@ class AlarmClock:
                 action(*args)
             except (TypeError, ValueError) as e:
                 print(f'Ошибка в параметрах: "{e}". Воспользуйтесь справкой "help"')
+            except OSError as e:
+                print(f'Ошибка файла: "{e}"')
                 # raise e
-        self.__ringerAwailable = False
-        self.__ringer.join(timeout=2)
 
 
     def _todoHelp(self):
@@ -451,11 +1611,15 @@ class AlarmClock:
             print('>', name, '-', '*' if text is None else text.strip())
 
 
-    def _todoNewAlarm(self, time='', when=None, repeat=None):
-        ''' установить новый будильник
-            time - время чч:мм - обязательный
-            when - дата (дд.мм.гггг) или дени недели через запятую (вт,чт,сб). Если не указано - звонит каждый день.
-            repeat - повторы. формат: число:минуты, если пусто - звоним один раз'''
+    @abc.abstractmethod
+    def _searchSounds(self, text):
+        ''' поиск мелодий по части названия: список (id, имя, длительность) '''
+
+
+    def _askNewAlarm(self, time='', when=None, repeat=None):
+        ''' опрос пользователя о параметрах нового будильника
+            :return: (time, when, repeat, msg, soundNum) - аргументы для Alarm
+        '''
         # Если время не задали, надо спросить
         if not time:
             time = input('Введите время будильника "чч:мм": ')
@@ -470,29 +1634,164 @@ class AlarmClock:
 
         alaemMessage = input('Введите сообщение для будильника. Пустая строка - стандартное сообщение: ').strip()
 
+        soundNum = ''
+        # мелодий может быть много - показываем только найденные по части названия
+        search = input('Поиск мелодии по части названия (пустая строка - звучит стандартная мелодия): ').strip()
+        while search:
+            tbl = PrettyTable()
+            tbl.title= 'Список мелодий'
+            tbl.field_names = ['ID', 'Наименование', 'Длительность']
+            for (sId, name, duration) in self._searchSounds(search):
+                tbl.add_row([sId, name, f'{int(duration) // 60}:{int(duration) % 60:02d}' if duration else '-'])
+            print(tbl)
+            soundNum = input('Укажите ID мелодии звонка (пустая строка - новый поиск): ').strip()
+            if soundNum:
+                break
+            search = input('Поиск мелодии по части названия (пустая строка - звучит стандартная мелодия): ').strip()
+
+        return (time, when, repeat, alaemMessage, soundNum)
+
+
+    def _printAlarms(self, rows, start=0):
+        ''' таблица будильников
+            :param rows: строки (звонит ли, id, время, условие, повторы)
+            :param start: сколько строк выведено на предыдущих страницах
+        '''
         tbl = PrettyTable()
-        tbl.title= 'Список мелодий'
-        tbl.field_names = ['#', 'Наименование']
-        for (i, sItem) in enumerate(soundFiles):
-            tbl.add_row([i + 1, sItem.name])
+        tbl.title= 'Список будильников'
+        tbl.field_names = ['#', 'ID', 'Время', 'Условие', 'Повторы']
+        for (i, (isRing, aId, aTime, when, repeats)) in enumerate(rows, start):
+            tbl.add_row([i + 1, f"{'*' if isRing else ' '}{aId}", aTime, when, repeats])
         print(tbl)
-        soundNum = input('Укажите мелодию звонка (пустая строка - звучит стандартная мелодия): ').strip()
 
 
-        alarm = Alarm(time, when, repeat, alaemMessage, soundNum)
+    @abc.abstractmethod
+    def _listPage(self, filters, after, limit):
+        ''' страница списка будильников с id больше after
+            :return: строки (звонит ли, id, время, условие, повторы)
+        '''
+
+
+    def _parseListArgs(self, args):
+        ''' параметры команды list -> (фильтры, after, строк на странице, потоковый вывод) '''
+        filters, after, page, plain = {}, 0, self.LIST_PAGE, False
+        for arg in args:
+            (key, _, value) = arg.partition('=')
+            if key == 'plain':
+                plain = True
+            elif key == 'ringing':
+                filters['ringing'] = True
+            elif key in ('from', 'to', 'day', 'kind'):
+                filters[key] = value
+            elif key == 'after':
+                after = int(value)
+            elif key == 'page':
+                page = int(value)
+                if page <= 0:
+                    raise ValueError('Размер страницы должен быть больше нуля')
+            else:
+                raise ValueError(f'Неизвестный параметр списка: {arg}')
+        return (filters, after, page, plain)
+
+
+    def _todoList(self, *args):
+        ''' список будильников (постранично)
+            параметры через пробел, все необязательные:
+            from=чч:мм to=чч:мм - время звонка в диапазоне, day=пн - звонит в этот день недели,
+            kind=dated|recurring - на дату / повторяющиеся, ringing - только звонящие,
+            after=ID - начать после будильника ID, page=N - строк на странице,
+            plain - вывод строками по мере чтения, без таблицы и без остановок'''
+        (filters, after, page, plain) = self._parseListArgs(args)
+        if plain:
+            while True:
+                count = 0
+                for (isRing, aId, aTime, when, repeats) in self._listPage(filters, after, self.LIST_CHUNK):
+                    print(f"{'*' if isRing else ' '}{aId}\t{aTime}\t{when}\t{repeats}")
+                    count += 1
+                    after = aId
+                if count < self.LIST_CHUNK:
+                    return
+        shown = 0
+        while True:
+            rows = list(self._listPage(filters, after, page))
+            if not rows:
+                if not shown:
+                    print('Будильников не найдено')
+                return
+            self._printAlarms(rows, shown)
+            shown += len(rows)
+            after = rows[-1][1]
+            if len(rows) < page:
+                return
+            if input(f'Дальше - Enter, закончить - любой текст (продолжить потом: list after={after}): ').strip():
+                return
+
+
+
+class AlarmClock(AlarmRepl):
+    ''' Класс управления будильниками '''
+
+    def __init__(self):
+        ''' главный цикл приложения '''
+        # запуск потока планировщика звонков
+        self.__scheduler = AlarmScheduler()
+        self.__ringer = threading.Thread(target = self.__scheduler.run)
+        self.__ringer.start()
+        # цикл опроса прользователя
+        self._repl()
+        self.__scheduler.stop()
+        self.__ringer.join(timeout=2)
+        app.close()
+
+
+    def _searchSounds(self, text):
+        return app.sounds.search(app.db.reader(), text, self.SOUND_PICK_LIMIT)
+
+
+    def _todoNewAlarm(self, time='', when=None, repeat=None):
+        ''' установить новый будильник
+            time - время чч:мм - обязательный
+            when - дата (дд.мм.гггг) или дени недели через запятую (вт,чт,сб). Если не указано - звонит каждый день.
+            repeat - повторы. формат: число:минуты, если пусто - звоним один раз'''
+        alarm = Alarm(*self._askNewAlarm(time, when, repeat))
         if alarm.save():
             print(f'Будильник {alarm} успешно добавлен')
 
 
-    def _todoList(self):
-        ''' список будильников '''
-        alarms = Alarm.getAll()
-        tbl = PrettyTable()
-        tbl.title= 'Список будильников'
-        tbl.field_names = ['#', 'ID', 'Время', 'Условие', 'Повторы']
-        for (i, alarm) in enumerate(alarms):
-            tbl.add_row([i + 1, f"{'*' if alarm.isRing else ' '}{alarm.id}", alarm.time, alarm.when, alarm.repeats])
-        print(tbl)
+    def _listPage(self, filters, after, limit):
+        return ((alarm.isRing, alarm.id, alarm.time, alarm.when, alarm.repeats) for alarm in Alarm.query(filters, after, limit))
+
+
+    def _todoRescanSounds(self):
+        ''' полное пересканирование каталога мелодий (если файлы перезаписывались на месте) '''
+        print(f'Изменилось мелодий: {app.sounds.rescan(app.db, force=True)}')
+
+
+    def __fileFormat(self, path):
+        ''' формат файла импорта / экспорта по расширению '''
+        return 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.json', '.ndjson') else 'csv'
+
+
+    def _todoImport(self, path=None):
+        ''' импорт будильников из файла
+            path - файл .csv (колонки time,when,repeat,msg,sound) или .jsonl (объекты с теми же ключами)'''
+        if not path:
+            path = input('Введите путь к файлу импорта: ').strip()
+        with open(path, newline='', encoding='utf-8') as f:
+            (count, errors) = Alarm.importFrom(f, self.__fileFormat(path))
+        for (lineNo, err) in errors:
+            print(f'Строка {lineNo}: {err}')
+        print(f'Импортировано будильников: {count}, ошибок: {len(errors)}')
+
+
+    def _todoExport(self, path=None):
+        ''' экспорт будильников в файл
+            path - файл .csv или .jsonl'''
+        if not path:
+            path = input('Введите путь к файлу экспорта: ').strip()
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            count = Alarm.exportTo(f, self.__fileFormat(path))
+        print(f'Экспортировано будильников: {count}')
 
 
     def __getAlarmPerId(self, msg, aId=None):
@@ -507,6 +1806,8 @@ class AlarmClock:
 
         if alarm.stopDing():
             print(f'Будильник {alarm} остановлен')
+        elif alarm.isForeignRing:
+            print(f'Будильник {alarm} звонит у другого экземпляра приложения - остановить его можно только там')
 
     def _todoDelete(self, aId=None):
         ''' Удаление будильника по id'''
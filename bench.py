@@ -0,0 +1,543 @@
+''' Замеры производительности горячих путей будильника на синтетических базах.
+
+    Запуск: python bench.py [--sizes 1000,10000,100000] [--out bench.json]
+    Результат - JSON (в stdout или файл), который можно сравнивать между коммитами.
+    Работает без сети и без mpv: вместо плеера запускается заглушка, вместо окна сообщения - ничего.
+'''
+import argparse, contextlib, datetime, gc, io, itertools, json, os, platform, random, shutil, signal, statistics, subprocess, sys, tempfile, time, tracemalloc, types
+
+import alarmClock as ac
+from metrics import Metrics, NullMetrics
+from player import IpcPlayer
+import evaluator
+import simulate
+
+
+# доли видов будильников в синтетической базе
+ALARM_MIX = (
+    ('daily', 0.4),
+    ('weekdays', 0.3),
+    ('dated', 0.15),
+    ('repeating', 0.15),
+)
+
+
+# бюджет времени импорта модуля alarmClock, сек
+IMPORT_BUDGET = 0.5
+
+
+def useDb(path):
+    ''' переключаем модуль будильника на заданный файл базы (с заглушками вместо плеера и окна сообщения) '''
+    ac.app.close()
+    ac.app = ac.AppContext({
+        'dbFile': path,
+        'player': shutil.which('true') or 'true',
+        'sound': os.devnull,
+        'notifier': 'none',
+        'soundDir': '',
+    })
+
+
+def syntheticRows(n, seed=1):
+    ''' строки таблицы alarms (time + COND_COLUMNS) для синтетической базы '''
+    rnd = random.Random(seed)
+    kinds = [k for (k, _) in ALARM_MIX]
+    weights = [w for (_, w) in ALARM_MIX]
+    today = datetime.date.today().toordinal()
+    for _ in range(n):
+        kind = rnd.choices(kinds, weights)[0]
+        cond = {}
+        if kind == 'weekdays':
+            cond['days'] = rnd.sample(ac.Alarm.DAYS, rnd.randint(1, 6))
+        elif kind == 'dated':
+            cond['date'] = datetime.date.fromordinal(today + rnd.randint(0, 365)).strftime('%d.%m.%Y')
+        elif kind == 'repeating':
+            cond.update({'count': rnd.randint(1, 10), 'interval': rnd.randint(1, 15)})
+        if rnd.random() < 0.5:
+            cond['msg'] = f'сообщение {rnd.randint(1, 1000)}'
+        yield (rnd.randrange(24 * 60), *ac.Alarm.condToColumns(cond))
+
+
+def makeDb(path, n):
+    ''' создание синтетической базы на n будильников '''
+    useDb(path)
+    ac.app.db.write(
+        f'insert into alarms (time, {", ".join(ac.Alarm.COND_COLUMNS)}) values (?, ?, ?, ?, ?, ?, ?)',
+        syntheticRows(n), many=True
+    ).result()
+
+
+def measure(fn, repeat=5):
+    ''' время выполнения fn (сек): лучшее и медиана по repeat запускам '''
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return {'best': min(times), 'median': statistics.median(times), 'runs': repeat}, result
+
+
+def benchRinger(n):
+    stats, alarms = measure(ac.Alarm.ringerAlarms)
+    stats['matched'] = len(alarms)
+    return stats
+
+
+def benchGetAll(n):
+    stats, alarms = measure(ac.Alarm.getAll, repeat=3)
+    stats['loaded'] = len(alarms)
+    return stats
+
+
+def benchListRender(n):
+    ''' первая страница списка, первая страница с фильтром и потоковый вывод всего списка (list plain) '''
+    clock = ac.AlarmClock.__new__(ac.AlarmClock)
+    page = lambda filters: clock._printAlarms(clock._listPage(filters, 0, clock.LIST_PAGE))
+    with contextlib.redirect_stdout(io.StringIO()):
+        firstPage, _ = measure(lambda: page({}))
+        filteredPage, _ = measure(lambda: page({'from': '07:00', 'to': '07:59', 'day': 'пн', 'kind': 'recurring'}))
+        plain, _ = measure(lambda: clock._todoList('plain'), repeat=1 if n > 100000 else 3)
+    return {'firstPage': firstPage, 'filteredPage': filteredPage, 'plain': plain}
+
+
+def benchRecords(n):
+    ''' все будильники объектами Alarm: время загрузки, память на будильник и цена разбора условий (alarm.when) '''
+    stats, alarms = measure(ac.Alarm.getAll, repeat=1 if n > 100000 else 3)
+    touch, _ = measure(lambda: [alarm.when for alarm in alarms], repeat=1)
+    del alarms
+    gc.collect()
+    tracemalloc.start()
+    alarms = ac.Alarm.getAll()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'load': stats, 'bytesPerAlarm': size / max(len(alarms), 1), 'firstWhen': touch}
+
+
+def benchCacheLoad(n):
+    def load():
+        cache = ac.AlarmCache()
+        cache.refresh()
+        return cache
+    stats, _ = measure(load, repeat=3)
+    return stats
+
+
+# сколько будильников сверять поштучно с Alarm.available / Alarm.nextFire в замере evaluator
+EVALUATOR_DIFF_ALARMS = 5000
+# поштучный перебор (для сравнения скорости) - только на базах не больше этой
+EVALUATOR_SCALAR_LIMIT = 100000
+
+
+def evaluatorDiff(alarms, table, moments):
+    ''' расхождения AlarmTable с поштучными Alarm.available / Alarm.nextFire
+        :return: список описаний расхождений
+    '''
+    mismatches = []
+    for moment in moments:
+        expected = sorted(alarm.id for alarm in alarms if alarm.available(moment))
+        if sorted(table.dueAt(moment)) != expected:
+            mismatches.append(f'dueAt {moment}')
+        expected = sorted((alarm.id, alarm.nextFire(moment)) for alarm in alarms if alarm.nextFire(moment))
+        if sorted(table.nextFires(moment)) != expected:
+            mismatches.append(f'nextFires {moment}')
+        for withRepeats in (False, True):
+            end = moment + datetime.timedelta(days=1)
+            expected = []
+            for alarm in alarms:
+                # первые звонки (с повторами - и за предыдущие сутки) цепочкой nextFire
+                fireAt = alarm.nextFire(moment - datetime.timedelta(days=1 if withRepeats else 0, microseconds=1))
+                while fireAt and fireAt < end:
+                    reps = alarm.repeatsTuple if withRepeats else None
+                    for k in range(reps[0] + 1 if reps else 1):
+                        occurrence = fireAt + datetime.timedelta(minutes=k * reps[1]) if k else fireAt
+                        if moment <= occurrence < end:
+                            expected.append((occurrence, alarm.id))
+                    fireAt = alarm.nextFire(fireAt)
+            if table.dueBetween(moment, end, withRepeats) != sorted(expected):
+                mismatches.append(f'dueBetween {moment} withRepeats={withRepeats}')
+    return mismatches
+
+
+def benchEvaluator(n):
+    ''' evaluator.AlarmTable: сборка колонок, будильники минуты, ближайшие звонки всех будильников
+        и сверка результатов с поштучными Alarm.available / Alarm.nextFire
+    '''
+    rnd = random.Random(3)
+    con = ac.app.db.reader()
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    result = {}
+    backends = (('numpy', True), ('array', False)) if evaluator.loadNumpy() is not None else (('array', False),)
+    alarms = None
+    if n <= EVALUATOR_SCALAR_LIMIT:
+        alarms = ac.Alarm.getAll()
+        result['scalar'] = {
+            'available': measure(lambda: [alarm.id for alarm in alarms if alarm.available(now)], repeat=3)[0],
+            'nextFire': measure(lambda: [alarm.nextFire(now) for alarm in alarms], repeat=1)[0],
+        }
+    # моменты сверки: случайные в ближайший год и моменты будильников на дату
+    sample = list(itertools.islice(ac.Alarm.iterAll(), EVALUATOR_DIFF_ALARMS))
+    sampleRows = con.execute(f'select {", ".join(evaluator.COLUMNS)} from alarms order by id limit ?', (EVALUATOR_DIFF_ALARMS,)).fetchall()
+    dated = [alarm for alarm in sample if 'date' in alarm._cond]
+    moments = [now + datetime.timedelta(minutes=rnd.randrange(365 * 24 * 60), seconds=rnd.choice((0, 30))) for _ in range(3)]
+    moments += [alarm.nextFire(now) or now for alarm in rnd.sample(dated, min(len(dated), 2))]
+    for (name, useNumpy) in backends:
+        stats, table = measure(lambda: evaluator.AlarmTable.fromDb(con, useNumpy), repeat=1)
+        result[name] = {
+            'build': stats,
+            'dueAt': measure(lambda: table.dueAt(now))[0],
+            'nextFires': measure(lambda: table.nextFires(now), repeat=1)[0],
+            'dueBetweenDay': measure(lambda: table.dueBetween(now, now + datetime.timedelta(days=1), True), repeat=1)[0],
+        }
+        result[name]['mismatches'] = evaluatorDiff(sample, evaluator.AlarmTable(sampleRows, useNumpy), moments)
+    return result
+
+
+def benchSave(n, tmpDir):
+    ''' скорость Alarm.save (одна транзакция на будильник) на отдельной пустой базе '''
+    count = min(n, 2000)
+    path = os.path.join(tmpDir, f'save-{n}.db')
+    prevDb = ac.app.dbFile
+    useDb(path)
+    alarms = [ac.Alarm(f'{i // 60 % 24:02d}:{i % 60:02d}', '-', '-', '', '') for i in range(count)]
+    start = time.perf_counter()
+    for alarm in alarms:
+        alarm.save()
+    elapsed = time.perf_counter() - start
+    useDb(prevDb)
+    return {'alarms': count, 'seconds': elapsed, 'perSecond': count / elapsed if elapsed else None}
+
+
+def benchRepeatTodo(n):
+    ''' один тик диспетчера повторов при n ожидающих повторах (без запуска звонков) '''
+    rnd = random.Random(2)
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    times = []
+    due = 0
+    for _ in range(3):
+        scheduler = ac.AlarmScheduler()
+        alarms = {}
+        repeats = {}
+        for aId in range(1, n + 1):
+            alarm = ac.Alarm({'id': aId, 'time': rnd.randrange(24 * 60), 'days': ac.Alarm.ALL_DAYS, 'rcount': 10, 'rinterval': 5})
+            alarms[aId] = alarm
+            repeats[aId] = (now + datetime.timedelta(minutes=rnd.randrange(24 * 60)), 10, 5)
+        scheduler._AlarmScheduler__cache = types.SimpleNamespace(alarms=alarms)
+        scheduler._AlarmScheduler__repeats = repeats
+        heap = [(fireAt, aId) for (aId, (fireAt, _, _)) in repeats.items()]
+        ac.heapq.heapify(heap)
+        scheduler._AlarmScheduler__repeatHeap = heap
+        due = sum(1 for (fireAt, _, _) in repeats.values() if fireAt <= now)
+        start = time.perf_counter()
+        scheduler._AlarmScheduler__alarmRingerRepeatTodo(now)
+        times.append(time.perf_counter() - start)
+        ac.app.db.flush()
+    return {'best': min(times), 'median': statistics.median(times), 'runs': len(times), 'pending': n, 'due': due}
+
+
+# сколько длится запуск плеера-заглушки в замере fanOut, сек (порядок Popen)
+PLAY_COST = 0.005
+# сколько разных мелодий у будильников в замере fanOut
+FAN_OUT_TRACKS = 10
+
+
+class StubPlayer:
+    ''' плеер-заглушка: "запуск" занимает PLAY_COST '''
+
+    def __init__(self):
+        self.plays = 0
+
+    def play(self, soundTrack):
+        time.sleep(PLAY_COST)
+        self.plays += 1
+        return self.plays
+
+    def stop(self, pid):
+        pass
+
+    def close(self):
+        pass
+
+
+class FanOutAlarm(ac.Alarm):
+    ''' будильник замера fanOut: мелодия - по id, без обращения к индексу мелодий '''
+
+    @property
+    def soundTrack(self):
+        return f'track-{self.id % FAN_OUT_TRACKS}'
+
+
+def benchFanOut(n):
+    ''' одновременный звонок min(n, 1000) будильников: задержки звонков при последовательном запуске и через пул '''
+    count = min(n, 1000)
+    result = {'alarms': count, 'tracks': FAN_OUT_TRACKS, 'playCost': PLAY_COST}
+    for (name, concurrency) in (('sequential', 1), ('pool', ac.AlarmRinger.CONCURRENCY)):
+        ac.app.env['ringConcurrency'] = concurrency
+        player = ac.app._AppContext__player = StubPlayer()
+        ringer = ac.AlarmRinger()
+        alarms = [FanOutAlarm({'id': aId, 'time': 0, 'days': ac.Alarm.ALL_DAYS}) for aId in range(1, count + 1)]
+        fireAt = datetime.datetime.now()
+        lags = [lag for (_, lag) in ringer.ring([(alarm, fireAt) for alarm in alarms])]
+        ringer.close()
+        result[name] = {'plays': player.plays, 'maxLag': max(lags), 'medianLag': statistics.median(lags)}
+    ac.app.env.pop('ringConcurrency')
+    ac.app._AppContext__player = None
+    ac.app.db.flush()
+    return result
+
+
+# до какого размера базы прогонять сутки расписания в виртуальном времени
+SIMULATE_LIMIT = 100000
+# как часто планировщик "стоит" в прогоне
+SIMULATE_STALL_EVERY = datetime.timedelta(hours=1)
+
+
+def benchSimulate(n):
+    ''' сутки расписания в виртуальном времени (с остановками планировщика и правкой будильников во время них):
+        скорость прогона и расхождения первых звонков с evaluator
+    '''
+    if n > SIMULATE_LIMIT:
+        return None
+    ac.app.db.flush()
+    start = datetime.datetime.now().replace(second=0, microsecond=0)
+    report = simulate.Simulation(ac.app.dbFile, start, datetime.timedelta(days=1), stallEvery=SIMULATE_STALL_EVERY).run()
+    return {key: report[key] for key in ('wallSeconds', 'minutesPerSecond', 'events', 'expectedRings', 'stallEdits', 'missingCount', 'unexpectedCount')}
+
+
+# замеры, выполняемые на каждой синтетической базе
+BENCHMARKS = {
+    'ringerAlarms': benchRinger,
+    'getAll': benchGetAll,
+    'records': benchRecords,
+    'listRender': benchListRender,
+    'cacheLoad': benchCacheLoad,
+    'repeatTodo': benchRepeatTodo,
+    'fanOut': benchFanOut,
+    'evaluator': benchEvaluator,
+    'simulate': benchSimulate,
+}
+
+
+def benchImport():
+    ''' время холодного импорта alarmClock в отдельном процессе (без .env, базы и tkinter) '''
+    code = (
+        'import sys, time; start = time.perf_counter(); import alarmClock; '
+        'print(time.perf_counter() - start, "tkinter" in sys.modules, alarmClock.app._AppContext__db is not None)'
+    )
+    times = []
+    for _ in range(3):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+        times.append(float(out[0]))
+    return {
+        'best': min(times), 'median': statistics.median(times), 'runs': len(times),
+        'budget': IMPORT_BUDGET, 'withinBudget': min(times) <= IMPORT_BUDGET,
+        'tkinterImported': out[1] == 'True', 'dbOpened': out[2] == 'True',
+    }
+
+
+def benchMetrics(calls=100000):
+    ''' цена одного observe: метрики выключены (NullMetrics) и включены (Metrics), нс на вызов '''
+    result = {}
+    for (name, metrics) in (('disabled', NullMetrics()), ('enabled', Metrics())):
+        start = time.perf_counter()
+        for i in range(calls):
+            metrics.observe('alarm_fire_lag_seconds', 0.01)
+        result[name] = (time.perf_counter() - start) / calls * 1e9
+    return result
+
+
+def benchClaims(instances, alarms=200, crashed=20, lease=2):
+    ''' несколько процессов-экземпляров на одной базе: каждый звонок должен прозвенеть ровно один раз,
+        в том числе звонки, захваченные "упавшим" экземпляром (его аренда истекает через lease сек)
+    '''
+    now = datetime.datetime.now()
+    # звонки текущей минуты - успеваем запустить экземпляры до её конца
+    if now.second > 50:
+        time.sleep(61 - now.second)
+        now = datetime.datetime.now()
+    minute = now.replace(second=0, microsecond=0)
+    with tempfile.TemporaryDirectory() as tmpDir:
+        path = os.path.join(tmpDir, 'claims.db')
+        prevDb = ac.app.dbFile
+        useDb(path)
+        ac.app.db.write(
+            f'insert into alarms (time, {", ".join(ac.Alarm.COND_COLUMNS)}) values (?, ?, ?, ?, ?, ?, ?)',
+            [(now.hour * 60 + now.minute, None, ac.Alarm.ALL_DAYS, 0, 0, None, None)] * alarms, many=True
+        ).result()
+        ac.app.db.write(
+            'insert into claims (aid, fireAt, owner, leaseUntil) values (?, ?, ?, ?)',
+            [(aId, int(minute.timestamp()), 'crashed', int(time.time()) + lease) for aId in range(1, crashed + 1)], many=True
+        ).result()
+        useDb(prevDb)
+        code = (
+            'import json, os, sys, threading, time; import alarmClock as ac; '
+            f'ac.app = ac.AppContext({{"dbFile": {path!r}, "player": {shutil.which("true") or "true"!r}, "sound": os.devnull, '
+            f'"notifier": "none", "soundDir": "", "claimLease": "{lease}"}}); '
+            'rung = []; ring = ac.AlarmRinger.ring; '
+            'ac.AlarmRinger.ring = lambda self, batch: (rung.extend(a.id for (a, _) in batch), ring(self, batch))[1]; '
+            'scheduler = ac.AlarmScheduler(); thread = threading.Thread(target=scheduler.run); thread.start(); '
+            f'time.sleep({lease + 3}); scheduler.stop(); thread.join(); ac.app.close(); print(json.dumps(rung))'
+        )
+        procs = [
+            subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            for _ in range(instances)
+        ]
+        rungBy = [json.loads(proc.communicate()[0]) for proc in procs]
+    rung = [aId for ids in rungBy for aId in ids]
+    return {
+        'instances': instances, 'alarms': alarms, 'crashedClaims': crashed,
+        'rings': len(rung), 'duplicates': len(rung) - len(set(rung)), 'missed': alarms - len(set(rung)),
+        'perInstance': [len(ids) for ids in rungBy],
+    }
+
+
+def benchIpc():
+    ''' IpcPlayer против поддельного плеера (python player.py --input-ipc-server=...): команды loadfile/stop,
+        перезапуск убитого тёплого процесса, запуск отдельным процессом, если тёплый плеер завис или не стартует
+    '''
+    playerPy = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'player.py')
+    result = {}
+    with tempfile.TemporaryDirectory() as tmpDir:
+        log = os.path.join(tmpDir, 'commands.jsonl')
+        fake = os.path.join(tmpDir, 'fake-player')
+        broken = os.path.join(tmpDir, 'broken-player')
+        with open(fake, 'w') as f:
+            f.write(f'#!/bin/sh\nexec {sys.executable} {playerPy} "$@" --log={log}\n')
+        # тёплый процесс не стартует, а "на один звонок" работает
+        with open(broken, 'w') as f:
+            f.write(f'#!/bin/sh\ncase "$*" in *--input-ipc-server=*) exit 1;; esac\nexec {sys.executable} {playerPy} "$@"\n')
+        for path in (fake, broken):
+            os.chmod(path, 0o755)
+
+        def commands():
+            with open(log, encoding='utf-8') as f:
+                return [json.loads(line) for line in f]
+
+        def exited(pid, timeout=5):
+            deadline = time.monotonic() + timeout
+            while pid in player._supervisor.running() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            return pid not in player._supervisor.running()
+
+        def stopped(pid, timeout=5):
+            ''' ждём, пока процесс действительно остановится (сигнал доходит не мгновенно) '''
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                with open(f'/proc/{pid}/stat') as f:
+                    if f.read().rsplit(')', 1)[1].split()[0] == 'T':
+                        return
+                time.sleep(0.01)
+
+        player = IpcPlayer(fake, os.path.join(tmpDir, 'player.sock'))
+        try:
+            warm = player.play('first.mp3')
+            same = player.play('second.mp3')
+            player.stop(warm)
+            result['commands'] = commands()
+            result['commandsOk'] = warm == same and result['commands'] == [
+                ['loadfile', 'first.mp3', 'replace'], ['loadfile', 'second.mp3', 'replace'], ['stop'],
+            ]
+            # тёплый процесс убит - следующий звонок запускает новый
+            os.kill(warm, signal.SIGKILL)
+            time.sleep(0.2)
+            restarted = player.play('third.mp3')
+            result['restarted'] = restarted != warm and commands()[-1] == ['loadfile', 'third.mp3', 'replace']
+            # тёплый процесс завис - звонок и остановка не ждут его бесконечно
+            os.kill(restarted, signal.SIGSTOP)
+            stopped(restarted)
+            start = time.perf_counter()
+            spawned = player.play('fourth.mp3')
+            result['hungPlaySeconds'] = time.perf_counter() - start
+            start = time.perf_counter()
+            player.stop(spawned)
+            result['hungStopSeconds'] = time.perf_counter() - start
+            result['hungFallback'] = spawned not in (warm, restarted) and exited(spawned)
+        finally:
+            player.close()
+        player = IpcPlayer(broken, os.path.join(tmpDir, 'broken.sock'))
+        try:
+            spawned = player.play('fifth.mp3')
+            player.stop(spawned)
+            result['startFallback'] = spawned in player._supervisor.running() or exited(spawned)
+        except OSError:
+            result['startFallback'] = False
+        finally:
+            player.close()
+    result['ok'] = all(result[key] for key in ('commandsOk', 'restarted', 'hungFallback', 'startFallback'))
+    return result
+
+
+def gitRevision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(sizes, only=None, claims=0, ipc=False):
+    ''' прогон всех замеров по всем размерам баз
+        :param sizes: размеры синтетических баз
+        :param only: имена замеров, которые нужно выполнить (None - все)
+        :param claims: число экземпляров для проверки захвата звонков (0 - не проверять)
+        :param ipc: проверить тёплый плеер (IpcPlayer) на поддельном плеере
+    '''
+    result = {
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'sqlite': ac.sqlite3.sqlite_version,
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'import': benchImport(),
+        'metricsObserveNs': benchMetrics(),
+        'results': {},
+    }
+    if claims:
+        result['claims'] = benchClaims(claims)
+    if ipc:
+        result['ipc'] = benchIpc()
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for n in sizes:
+            path = os.path.join(tmpDir, f'alarms-{n}.db')
+            start = time.perf_counter()
+            makeDb(path, n)
+            sizeResult = {'generateSeconds': time.perf_counter() - start}
+            for (name, bench) in BENCHMARKS.items():
+                if only and name not in only:
+                    continue
+                sizeResult[name] = bench(n)
+            if not only or 'save' in only:
+                sizeResult['save'] = benchSave(n, tmpDir)
+            result['results'][str(n)] = sizeResult
+            print(f'{n}: готово', file=sys.stderr)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замеры производительности будильника')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='размеры синтетических баз через запятую (до 1000000)')
+    parser.add_argument('--only', default='', help='выполнить только перечисленные замеры (через запятую)')
+    parser.add_argument('--out', default='', help='файл для JSON-результата (по умолчанию stdout)')
+    parser.add_argument('--claims', type=int, default=0, help='проверить захват звонков N процессами на одной базе (код возврата 1 при повторных или пропущенных звонках)')
+    parser.add_argument('--ipc', action='store_true', help='проверить тёплый плеер на поддельном плеере (код возврата 1 при ошибке)')
+    parser.add_argument('--check-import-budget', action='store_true', help='код возврата 1, если импорт не укладывается в бюджет или тянет tkinter/базу')
+    args = parser.parse_args()
+
+    result = run([int(s) for s in args.sizes.split(',') if s], [s for s in args.only.split(',') if s] or None, args.claims, args.ipc)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    startup = result['import']
+    if args.check_import_budget and (not startup['withinBudget'] or startup['tkinterImported'] or startup['dbOpened']):
+        sys.exit(1)
+    if args.claims and (result['claims']['duplicates'] or result['claims']['missed']):
+        sys.exit(1)
+    if args.ipc and not result['ipc']['ok']:
+        sys.exit(1)
+    # прогон в виртуальном времени должен звонить ровно по расписанию
+    if any((sizeResult.get('simulate') or {}).get('missingCount') or (sizeResult.get('simulate') or {}).get('unexpectedCount') for sizeResult in result['results'].values()):
+        sys.exit(1)
+    # пакетная проверка условий должна совпадать с поштучной
+    if any(backend.get('mismatches') for sizeResult in result['results'].values() for backend in sizeResult.get('evaluator', {}).values()):
+        sys.exit(1)
@@ -0,0 +1,62 @@
+''' Часы планировщика: настоящие и виртуальные (для прогона расписания быстрее реального времени) '''
+import datetime, threading
+
+
+
+class SystemClock:
+    ''' Настоящее время '''
+
+    def now(self):
+        ''' текущий момент (datetime) '''
+        return datetime.datetime.now()
+
+
+    def wait(self, event, timeout):
+        ''' ожидание события не дольше timeout секунд
+            :return: True - событие наступило
+        '''
+        return event.wait(timeout)
+
+
+
+class VirtualClock:
+    ''' Виртуальное время: ожидание не спит, а сразу переводит часы вперёд.
+        Когда часы доходят до конца прогона, вызывается onEnd
+    '''
+
+    def __init__(self, start, end=None, onEnd=None):
+        '''
+            :param start: начальный момент
+            :param end: конец прогона (None - без конца)
+            :param onEnd: что вызвать, когда часы дошли до end
+        '''
+        self.__now = start
+        self.__end = end
+        self.__lock = threading.Lock()
+        self.onEnd = onEnd
+
+
+    def now(self):
+        with self.__lock:
+            return self.__now
+
+
+    def advance(self, seconds):
+        ''' перевод часов вперёд
+            :return: False - дошли до конца прогона
+        '''
+        with self.__lock:
+            self.__now += datetime.timedelta(seconds=seconds)
+            if self.__end is None or self.__now < self.__end:
+                return True
+            self.__now = self.__end
+        if self.onEnd:
+            self.onEnd()
+        return False
+
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+        self.advance(timeout)
+        return event.is_set()
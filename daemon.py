@@ -0,0 +1,187 @@
+''' Демон будильников: планировщик + управление через Unix-сокет (JSON по строке на запрос/ответ).
+
+    Запрос:  {"cmd": "new-alarm", "args": {"time": "07:00", "when": "пн,вт", "repeat": "3:5", "msg": "", "sound": ""}}
+             {"cmd": "list", "args": {"filters": {"from": "07:00", "day": "пн"}, "after": 120, "limit": 50}}
+    Ответ:   {"ok": true, "result": ...} или {"ok": false, "error": "..."}
+    Команды: new-alarm, list, stop, delete, sounds
+'''
+import asyncio, json, logging, os, signal, socket, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from alarmClock import Alarm, AlarmScheduler, AlarmRepl, app
+
+
+def socketPath():
+    ''' путь к управляющему сокету демона (настройка controlSocket) '''
+    return app.env.get('controlSocket') or os.path.join(tempfile.gettempdir(), 'alarm-clock.sock')
+
+
+
+class AlarmDaemon:
+    ''' Демон будильников: обслуживает сколько угодно клиентов одновременно,
+        запросы выполняются по очереди в отдельном потоке (со своим соединением с базой),
+        чтобы медленные команды (пересканирование мелодий, ожидание записи) не останавливали цикл событий
+    '''
+
+    def __init__(self, path=None):
+        ''' :param path: путь к управляющему сокету '''
+        self.__path = path or socketPath()
+        self.__scheduler = AlarmScheduler()
+        # один поток - запросы всех клиентов выполняются по очереди, в порядке поступления
+        self.__executor = None
+
+
+    def _cmdNewAlarm(self, time='', when='', repeat='', msg='', sound=''):
+        alarm = Alarm(str(time), str(when or '-'), str(repeat or '-'), str(msg or ''), str(sound or ''))
+        alarm.save()
+        return {'id': alarm.id, 'alarm': str(alarm)}
+
+
+    def _cmdList(self, filters=None, after=0, limit=None):
+        return [[alarm.isRing, alarm.id, alarm.time, alarm.when, alarm.repeats] for alarm in Alarm.query(filters, after, limit)]
+
+
+    def _cmdStop(self, id):
+        alarm = Alarm.getById(id)
+        return {'done': alarm.stopDing(), 'foreign': alarm.isForeignRing, 'alarm': str(alarm)}
+
+
+    def _cmdDelete(self, id):
+        alarm = Alarm.getById(id)
+        return {'done': alarm.delete(), 'alarm': str(alarm)}
+
+
+    def _cmdSounds(self, text='', limit=AlarmRepl.SOUND_PICK_LIMIT):
+        return app.sounds.search(app.db.reader(), text, limit)
+
+
+    def execute(self, request):
+        ''' выполнение одного запроса
+            :param request: словарь {"cmd": ..., "args": {...}}
+            :return: словарь ответа
+        '''
+        cmd = request.get('cmd') if isinstance(request, dict) else None
+        handler = getattr(self, '_cmd' + ''.join(map(lambda s: s.title(), str(cmd).split('-'))), None)
+        if handler is None:
+            return {'ok': False, 'error': f'Неизвестная команда: {cmd}'}
+        try:
+            return {'ok': True, 'result': handler(**(request.get('args') or {}))}
+        except (TypeError, ValueError) as e:
+            return {'ok': False, 'error': str(e)}
+        except Exception as e:
+            # ошибка не должна обрывать соединение клиента
+            logging.getLogger('alarmClock').exception('ошибка команды %s', cmd)
+            return {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+
+    async def __serveClient(self, reader, writer):
+        ''' обслуживание одного подключения: запросы по строке, ответы по строке '''
+        try:
+            loop = asyncio.get_running_loop()
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    response = {'ok': False, 'error': f'Неверный запрос: {e}'}
+                else:
+                    response = await loop.run_in_executor(self.__executor, self.execute, request)
+                writer.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+    async def serve(self):
+        ''' работа демона до SIGINT / SIGTERM '''
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopped.set)
+        # планировщик блокирующий - работает в потоке исполнителя цикла
+        ringer = loop.run_in_executor(None, self.__scheduler.run)
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='daemonCmd')
+        if os.path.exists(self.__path):
+            os.unlink(self.__path)
+        server = await asyncio.start_unix_server(self.__serveClient, path=self.__path)
+        print(f'Демон будильников слушает {self.__path}', flush=True)
+        async with server:
+            await stopped.wait()
+        self.__scheduler.stop()
+        await ringer
+        self.__executor.shutdown(wait=True)
+        os.unlink(self.__path)
+        app.close()
+
+
+    def run(self):
+        asyncio.run(self.serve())
+
+
+
+class AlarmClient(AlarmRepl):
+    ''' Консоль управления демоном будильников (те же команды, что и у локального будильника) '''
+
+    def __init__(self, path=None):
+        ''' :param path: путь к управляющему сокету демона '''
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__sock.connect(path or socketPath())
+        self.__reader = self.__sock.makefile('r', encoding='utf-8')
+        try:
+            self._repl()
+        finally:
+            self.__reader.close()
+            self.__sock.close()
+
+
+    def request(self, cmd, **args):
+        ''' запрос к демону
+            :return: результат команды; ошибка демона - ValueError
+        '''
+        self.__sock.sendall((json.dumps({'cmd': cmd, 'args': args}, ensure_ascii=False) + '\n').encode('utf-8'))
+        line = self.__reader.readline()
+        if not line:
+            raise ConnectionError('Демон закрыл соединение')
+        response = json.loads(line)
+        if not response['ok']:
+            raise ValueError(response['error'])
+        return response['result']
+
+
+    def _searchSounds(self, text):
+        return self.request('sounds', text=text, limit=self.SOUND_PICK_LIMIT)
+
+
+    def _todoNewAlarm(self, time='', when=None, repeat=None):
+        ''' установить новый будильник
+            time - время чч:мм - обязательный
+            when - дата (дд.мм.гггг) или дени недели через запятую (вт,чт,сб). Если не указано - звонит каждый день.
+            repeat - повторы. формат: число:минуты, если пусто - звоним один раз'''
+        fields = self._askNewAlarm(time, when, repeat)
+        result = self.request('new-alarm', **dict(zip(Alarm.RECORD_FIELDS, fields)))
+        print(f'Будильник {result["alarm"]} успешно добавлен')
+
+
+    def _listPage(self, filters, after, limit):
+        return self.request('list', filters=filters, after=after, limit=limit)
+
+
+    def _todoStop(self, aId=None):
+        ''' Остановка конкретного будильника '''
+        if aId is None:
+            aId = input('Введите id будильника для остановки: ').strip()
+        result = self.request('stop', id=aId)
+        if result['done']:
+            print(f'Будильник {result["alarm"]} остановлен')
+        elif result.get('foreign'):
+            print(f'Будильник {result["alarm"]} звонит у другого экземпляра приложения - остановить его можно только там')
+
+
+    def _todoDelete(self, aId=None):
+        ''' Удаление будильника по id'''
+        if aId is None:
+            aId = input('Введите id будильника для удаления: ').strip()
+        result = self.request('delete', id=aId)
+        if result['done']:
+            print(f'Будильник {result["alarm"]} удалён')
@@ -0,0 +1,160 @@
+''' Доступ к базе будильников: WAL, соединения для чтения по потокам и один поток-писатель '''
+import queue, sqlite3, threading, time
+from concurrent.futures import Future
+
+from metrics import NullMetrics
+
+
+class Database:
+    ''' База в режиме WAL. Читает каждый поток через своё соединение, а все изменения идут
+        через очередь в единственный поток-писатель, который складывает накопившиеся
+        за один заход записи в одну транзакцию (один fsync вместо fsync на каждый будильник)
+    '''
+    # сколько ждать (сек) следующих записей, прежде чем закрыть транзакцию
+    BATCH_WINDOW = 0.002
+    # максимум записей в одной транзакции
+    BATCH_LIMIT = 1000
+    # ожидание блокировки базы другим процессом, сек
+    BUSY_TIMEOUT = 10
+    # сколько раз начинать транзакцию, если база занята дольше BUSY_TIMEOUT, и пауза между попытками, сек
+    BEGIN_ATTEMPTS = 2
+    BEGIN_BACKOFF = 1
+
+
+    def __init__(self, path, metrics=None):
+        '''
+            :param path: файл базы
+            :param metrics: метрики (время фиксации и размер транзакций писателя)
+        '''
+        self.__path = path
+        self.__metrics = metrics or NullMetrics()
+        self.__local = threading.local()
+        self.__readers = []
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__writer = None
+
+
+    def __connect(self, **kwargs):
+        con = sqlite3.connect(self.__path, timeout=self.BUSY_TIMEOUT, **kwargs)
+        con.execute('pragma journal_mode = wal')
+        # в WAL достаточно синхронизации на контрольных точках
+        con.execute('pragma synchronous = normal')
+        return con
+
+
+    def reader(self):
+        ''' соединение для чтения текущего потока '''
+        con = getattr(self.__local, 'con', None)
+        if con is None:
+            con = self.__local.con = self.__connect()
+            with self.__lock:
+                self.__readers.append(con)
+        return con
+
+
+    def call(self, fn):
+        ''' выполнение fn(con) в потоке-писателе внутри общей транзакции
+            :return: Future с результатом fn
+        '''
+        future = Future()
+        with self.__lock:
+            if self.__writer is None:
+                self.__writer = threading.Thread(target=self.__writeLoop, name='dbWriter', daemon=True)
+                self.__writer.start()
+        self.__queue.put((fn, future))
+        return future
+
+
+    def write(self, sql, params=(), many=False):
+        ''' запись одного запроса (executemany при many=True)
+            :return: Future с lastrowid
+        '''
+        if many:
+            return self.call(lambda con: con.executemany(sql, params).lastrowid)
+        return self.call(lambda con: con.execute(sql, params).lastrowid)
+
+
+    def flush(self):
+        ''' ожидание записи всего, что уже поставлено в очередь '''
+        if self.__writer is not None:
+            self.call(lambda con: None).result()
+
+
+    def __begin(self, con):
+        ''' начало транзакции писателя (база занята другим процессом - ещё попытка после паузы) '''
+        for attempt in range(self.BEGIN_ATTEMPTS):
+            try:
+                con.execute('begin immediate')
+                return
+            except sqlite3.OperationalError:
+                if attempt == self.BEGIN_ATTEMPTS - 1:
+                    raise
+                time.sleep(self.BEGIN_BACKOFF)
+
+
+    def __writeLoop(self):
+        ''' поток-писатель: забирает из очереди всё накопившееся и пишет одной транзакцией '''
+        con = self.__connect(isolation_level=None, check_same_thread=False)
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+            batch = [item]
+            try:
+                while len(batch) < self.BATCH_LIMIT:
+                    item = self.__queue.get(timeout=self.BATCH_WINDOW)
+                    if item is None:
+                        self.__queue.put(None)
+                        break
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            results = []
+            try:
+                self.__begin(con)
+                for (fn, future) in batch:
+                    # каждая запись - в своей точке сохранения, ошибка одной не отменяет остальные
+                    con.execute('savepoint item')
+                    try:
+                        results.append((future, fn(con), None))
+                        con.execute('release item')
+                    except BaseException as e:
+                        con.execute('rollback to item')
+                        con.execute('release item')
+                        results.append((future, None, e))
+                start = time.perf_counter()
+                con.execute('commit')
+                self.__metrics.observe('alarm_db_commit_seconds', time.perf_counter() - start)
+            except BaseException as e:
+                # транзакция не началась или не зафиксировалась - отказ всей пачке, а писатель работает дальше
+                if con.in_transaction:
+                    try:
+                        con.execute('rollback')
+                    except sqlite3.Error:
+                        pass
+                results = [(future, None, e) for (_, future) in batch]
+            self.__metrics.observe('alarm_db_batch_size', len(batch))
+            for (future, result, error) in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+        con.close()
+
+
+    def close(self):
+        ''' дописываем очередь, останавливаем писателя и закрываем соединения '''
+        with self.__lock:
+            writer, self.__writer = self.__writer, None
+            readers, self.__readers = self.__readers, []
+        if writer is not None:
+            self.__queue.put(None)
+            writer.join()
+        for con in readers:
+            try:
+                con.close()
+            except sqlite3.ProgrammingError:
+                # соединение другого потока - закроется вместе с ним
+                pass
+        self.__local = threading.local()
@@ -0,0 +1,181 @@
+''' Пакетная проверка условий будильников.
+
+    Условия всех будильников собраны в колонки (минута суток, маска дней недели, дата, повторы),
+    а звонки на минуту, на интервал до суток или ближайшие звонки всех будильников выбираются
+    одной маской по колонкам. Колонки - массивы numpy, если он установлен, иначе array
+    (тогда проверка - один цикл по колонкам без создания объектов Alarm).
+'''
+import array, datetime
+
+
+# numpy (None - не установлен); импортируется при сборке первой таблицы, а не при запуске приложения
+numpy = None
+_numpyLoaded = False
+
+
+def loadNumpy():
+    ''' numpy, если он установлен (импорт - при первом вызове) '''
+    global numpy, _numpyLoaded
+    if not _numpyLoaded:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        (numpy, _numpyLoaded) = (module, True)
+    return numpy
+
+
+# все дни недели (маска колонки days)
+ALL_DAYS = 0b1111111
+# колонки таблицы alarms, из которых собираются условия
+COLUMNS = ('id', 'time', 'date', 'days', 'rcount', 'rinterval', )
+
+
+def weekdayBit(ordinal):
+    ''' бит дня недели даты (ordinal 1 - понедельник) '''
+    return 1 << ((ordinal - 1) % 7)
+
+
+def minuteOf(moment):
+    ''' момент -> минута от начала летоисчисления (ordinal * 1440 + минута суток) '''
+    return moment.toordinal() * 1440 + moment.hour * 60 + moment.minute
+
+
+def momentOf(minute):
+    ''' минута от начала летоисчисления -> datetime '''
+    return datetime.datetime.fromordinal(minute // 1440) + datetime.timedelta(minutes=minute % 1440)
+
+
+
+class AlarmTable:
+    ''' Условия будильников в колонках '''
+
+    def __init__(self, rows, useNumpy=None):
+        '''
+            :param rows: строки с колонками COLUMNS таблицы alarms (date - ordinal или None)
+            :param useNumpy: считать на numpy (None - если он установлен)
+        '''
+        self.useNumpy = useNumpy is not False and loadNumpy() is not None
+        columns = [array.array('q') for _ in COLUMNS]
+        (ids, minutes, dates, days, counts, intervals) = columns
+        for (aId, time, date, dayMask, rcount, rinterval) in rows:
+            ids.append(aId)
+            minutes.append(time)
+            dates.append(date or 0)
+            days.append(ALL_DAYS if dayMask is None else dayMask)
+            counts.append(rcount or 0)
+            intervals.append(rinterval or 0)
+        if self.useNumpy:
+            columns = [numpy.array(column, dtype=numpy.int64) for column in columns]
+        (self.ids, self.minutes, self.dates, self.days, self.counts, self.intervals) = columns
+
+
+    @classmethod
+    def fromDb(cls, con, useNumpy=None, chunk=10000):
+        ''' условия всех будильников из базы (чтение порциями из курсора) '''
+        cursor = con.cursor()
+        cursor.execute(f'select {", ".join(COLUMNS)} from alarms order by id')
+
+        def rows():
+            while chunkRows := cursor.fetchmany(chunk):
+                yield from chunkRows
+        table = cls(rows(), useNumpy)
+        cursor.close()
+        return table
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def dueAt(self, moment):
+        ''' id будильников, которые звонят в минуту moment (то же, что Alarm.available) '''
+        minute = moment.hour * 60 + moment.minute
+        ordinal = moment.toordinal()
+        bit = weekdayBit(ordinal)
+        if self.useNumpy:
+            # у будильника на дату дни недели не учитываются
+            mask = (self.minutes == minute) & numpy.where(self.dates == 0, (self.days & bit) != 0, self.dates == ordinal)
+            return self.ids[mask].tolist()
+        return [
+            aId for (aId, t, date, days) in zip(self.ids, self.minutes, self.dates, self.days)
+            if t == minute and (date == ordinal if date else days & bit)
+        ]
+
+
+    def nextFires(self, after):
+        ''' ближайший звонок каждого будильника строго после after (то же, что Alarm.nextFire)
+            :return: список (id будильника, datetime); будильники, которые больше не зазвонят, пропускаются
+        '''
+        limit = minuteOf(after)
+        base = after.toordinal()
+        if self.useNumpy:
+            fires = numpy.full(len(self.ids), -1, dtype=numpy.int64)
+            dated = self.dates != 0
+            candidate = self.dates * 1440 + self.minutes
+            hit = dated & (candidate > limit)
+            fires[hit] = candidate[hit]
+            # ближайшая неделя (+ сегодня) покрывает все варианты по дням недели
+            pending = ~dated
+            for shift in range(8):
+                candidate = (base + shift) * 1440 + self.minutes
+                hit = pending & ((self.days & weekdayBit(base + shift)) != 0) & (candidate > limit)
+                fires[hit] = candidate[hit]
+                pending &= ~hit
+            found = fires >= 0
+            return list(zip(self.ids[found].tolist(), map(momentOf, fires[found].tolist())))
+        bits = [weekdayBit(base + shift) for shift in range(8)]
+        result = []
+        for (aId, t, date, days) in zip(self.ids, self.minutes, self.dates, self.days):
+            if date:
+                if date * 1440 + t > limit:
+                    result.append((aId, momentOf(date * 1440 + t)))
+                continue
+            for shift in range(8):
+                candidate = (base + shift) * 1440 + t
+                if days & bits[shift] and candidate > limit:
+                    result.append((aId, momentOf(candidate)))
+                    break
+        return result
+
+
+    def dueBetween(self, start, end, withRepeats=False):
+        ''' все звонки в интервале [start, end) длиной не больше суток
+            :param withRepeats: вместе с повторами (повторы тянутся не дольше суток от первого звонка)
+            :return: отсортированный список (datetime, id будильника)
+        '''
+        if end - start > datetime.timedelta(days=1):
+            raise ValueError('Интервал больше суток')
+        # звонок в минуту m попадает в интервал, если m:00 >= start и m:00 < end
+        first = minuteOf(start) + (1 if (start.second, start.microsecond) != (0, 0) else 0)
+        last = minuteOf(end) + (1 if (end.second, end.microsecond) != (0, 0) else 0)
+        # повторы в интервал могут прийти от первых звонков предыдущих суток
+        days = range(start.toordinal() - (1 if withRepeats else 0), end.toordinal() + 1)
+        found = []
+        if self.useNumpy:
+            for ordinal in days:
+                active = numpy.where(self.dates == 0, (self.days & weekdayBit(ordinal)) != 0, self.dates == ordinal)
+                candidate = ordinal * 1440 + self.minutes
+                hit = active & (candidate >= first) & (candidate < last)
+                found.extend(zip(candidate[hit].tolist(), self.ids[hit].tolist()))
+                if not withRepeats:
+                    continue
+                repeating = active & (self.counts > 0)
+                (ids, candidate, counts, intervals) = (self.ids[repeating], candidate[repeating], self.counts[repeating], self.intervals[repeating])
+                for k in range(1, int(counts.max(initial=0)) + 1):
+                    occurrence = candidate + k * intervals
+                    hit = (counts >= k) & (occurrence >= first) & (occurrence < last)
+                    found.extend(zip(occurrence[hit].tolist(), ids[hit].tolist()))
+        else:
+            for ordinal in days:
+                bit = weekdayBit(ordinal)
+                for (aId, t, date, dayMask, count, interval) in zip(self.ids, self.minutes, self.dates, self.days, self.counts, self.intervals):
+                    if not (date == ordinal if date else dayMask & bit):
+                        continue
+                    candidate = ordinal * 1440 + t
+                    for k in range(count + 1 if withRepeats else 1):
+                        occurrence = candidate + k * interval
+                        if first <= occurrence < last:
+                            found.append((occurrence, aId))
+        found.sort()
+        return [(momentOf(minute), aId) for (minute, aId) in found]
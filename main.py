@@ -1,8 +1,23 @@
-from alarmClock import AlarmClock
-
-AlarmClock()
-
+import argparse
 
+from alarmClock import AlarmClock, app
 
+parser = argparse.ArgumentParser(description='Будильник')
+parser.add_argument('--headless', action='store_true', help='без графики: сообщения будильников выводятся в консоль')
+parser.add_argument('--daemon', action='store_true', help='фоновый режим: управление через Unix-сокет')
+parser.add_argument('--client', action='store_true', help='консоль управления запущенным демоном')
+parser.add_argument('--socket', default=None, help='путь к управляющему сокету демона (по умолчанию настройка controlSocket)')
+args = parser.parse_args()
 
+if args.headless:
+    app.env['notifier'] = 'stdout'
+app.configureLogging()
 
+if args.daemon:
+    from daemon import AlarmDaemon
+    AlarmDaemon(args.socket).run()
+elif args.client:
+    from daemon import AlarmClient
+    AlarmClient(args.socket)
+else:
+    AlarmClock()
@@ -0,0 +1,152 @@
+''' Метрики будильника в текстовом формате Prometheus (HTTP на локальном порту и/или файл) '''
+import bisect, os, threading
+
+
+# описания метрик (# HELP)
+DESCRIPTIONS = {
+    'alarm_ringer_query_seconds': 'время запроса будильников текущей минуты (Alarm.ringerAlarms)',
+    'alarm_cache_refresh_seconds': 'время сверки кэша будильников с базой',
+    'alarm_fire_lag_seconds': 'задержка звонка: запуск плеера минус назначенный момент',
+    'alarm_player_spawn_seconds': 'время запуска мелодии плеером',
+    'alarm_db_commit_seconds': 'время фиксации одной транзакции потока-писателя',
+    'alarm_db_batch_size': 'записей в одной транзакции потока-писателя',
+    'alarm_tick_seconds': 'время одного тика планировщика (без сна)',
+    'alarm_repeat_queue_depth': 'ожидающих повторов будильников',
+    'alarm_ringing': 'звонящих сейчас будильников',
+}
+
+# границы корзин гистограмм (для alarm_db_batch_size - число записей)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 5, 10, 50, 100, 500, 1000)
+
+
+
+class NullMetrics:
+    ''' Метрики выключены: все вызовы ничего не делают '''
+    enabled = False
+
+    def observe(self, name, value):
+        pass
+
+    def gauge(self, name, fn):
+        pass
+
+    def tick(self):
+        pass
+
+    def close(self):
+        pass
+
+
+
+class Metrics:
+    ''' Гистограммы и датчики. Гистограмма пополняется вызовом observe,
+        датчик - функция, значение которой берётся в момент выдачи метрик
+    '''
+    enabled = True
+
+
+    def __init__(self, path=None):
+        ''' :param path: файл, куда выгружать метрики после каждого тика планировщика '''
+        self.__path = path
+        self.__lock = threading.Lock()
+        # имя -> (границы корзин, счётчики корзин, сумма, количество)
+        self.__histograms = {}
+        self.__gauges = {}
+        self.__server = None
+
+
+    def observe(self, name, value):
+        ''' значение в гистограмму name '''
+        with self.__lock:
+            hist = self.__histograms.get(name)
+            if hist is None:
+                buckets = SIZE_BUCKETS if name.endswith('_size') else BUCKETS
+                hist = self.__histograms[name] = [buckets, [0] * (len(buckets) + 1), 0.0, 0]
+            hist[1][bisect.bisect_left(hist[0], value)] += 1
+            hist[2] += value
+            hist[3] += 1
+
+
+    def gauge(self, name, fn):
+        ''' датчик name: fn() вызывается при каждой выдаче метрик '''
+        with self.__lock:
+            self.__gauges[name] = fn
+
+
+    def render(self):
+        ''' все метрики в текстовом формате Prometheus '''
+        with self.__lock:
+            histograms = {name: (buckets, list(counts), total, count) for (name, (buckets, counts, total, count)) in self.__histograms.items()}
+            gauges = dict(self.__gauges)
+        lines = []
+        for (name, (buckets, counts, total, count)) in sorted(histograms.items()):
+            lines.append(f'# HELP {name} {DESCRIPTIONS.get(name, name)}')
+            lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for (le, n) in zip((*buckets, '+Inf'), counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f'{name}_sum {total}')
+            lines.append(f'{name}_count {count}')
+        for (name, fn) in sorted(gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                # датчик недоступен (например, база закрыта) - пропускаем
+                continue
+            lines.append(f'# HELP {name} {DESCRIPTIONS.get(name, name)}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+    def dump(self, path):
+        ''' выгрузка метрик в файл (атомарно - через временный файл) '''
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+    def tick(self):
+        ''' конец тика планировщика: выгружаем метрики в файл, если он задан '''
+        if self.__path:
+            self.dump(self.__path)
+
+
+    def serve(self, port, host='127.0.0.1'):
+        ''' выдача метрик по HTTP (GET /metrics) в фоновом потоке
+            (запросы обслуживаются по одному - датчикам хватает одного соединения с базой)
+        '''
+        # http.server нужен только с metricsPort - не импортируем его при запуске приложения
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = HTTPServer((host, port), Handler)
+        threading.Thread(target=self.__server.serve_forever, name='metrics', daemon=True).start()
+        return self.__server.server_address
+
+
+    def close(self):
+        ''' остановка HTTP-сервера и последняя выгрузка в файл '''
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+        self.tick()
@@ -0,0 +1,39 @@
+''' Способы показа сообщения сработавшего будильника '''
+import logging, os, sys
+
+
+def tkNotify(title, text):
+    ''' окно сообщения (tkinter импортируется только здесь - при первом звонке) '''
+    import tkinter.messagebox as msgBox
+    msgBox.showinfo(title, text)
+
+
+def stdoutNotify(title, text):
+    ''' вывод сообщения в консоль (без графики) '''
+    print(f'[{title}] {text}', flush=True)
+
+
+def logNotify(title, text):
+    ''' запись сообщения в лог '''
+    logging.getLogger('alarmClock').warning('%s: %s', title, text)
+
+
+def nullNotify(title, text):
+    ''' сообщения не показываются '''
+    pass
+
+
+# обработчики по значению настройки notifier
+NOTIFIERS = {
+    'tk': tkNotify,
+    'stdout': stdoutNotify,
+    'log': logNotify,
+    'none': nullNotify,
+}
+
+
+def defaultNotifier():
+    ''' окно - если есть графический дисплей, иначе консоль '''
+    if os.name == 'nt' or sys.platform == 'darwin' or os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'):
+        return 'tk'
+    return 'stdout'
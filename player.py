@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+''' Проигрыватели мелодий будильника '''
+import json, logging, os, select, signal, socket, subprocess, tempfile, threading, time
+
+
+class PlayerSupervisor:
+    ''' Присмотр за процессами плееров: завершившийся процесс сразу забирается (не остаётся зомби),
+        а о завершении сообщается onExit. Поток-сборщик ждёт на pidfd процессов (Linux 5.3+),
+        без pidfd - опрашивает процессы раз в POLL_INTERVAL секунд
+    '''
+    # как часто опрашивать процессы, для которых нет pidfd, сек
+    POLL_INTERVAL = 1
+
+
+    def __init__(self, onExit=None):
+        ''' :param onExit: callable(список pid) - вызывается из потока-сборщика, когда плееры завершились '''
+        self.onExit = onExit
+        # pid -> (Popen, pidfd или None)
+        self.__procs = {}
+        self.__lock = threading.Lock()
+        self.__thread = None
+        # канал, которым будим поток-сборщик (новый процесс или закрытие)
+        self.__wake = None
+        self.__closed = False
+
+
+    def add(self, proc):
+        ''' взять процесс под присмотр '''
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+        with self.__lock:
+            self.__procs[proc.pid] = (proc, pidfd,)
+            if self.__thread is None:
+                self.__wake = os.pipe()
+                os.set_blocking(self.__wake[0], False)
+                self.__thread = threading.Thread(target=self.__reap, name='player-reaper', daemon=True)
+                self.__thread.start()
+            os.write(self.__wake[1], b'.')
+
+
+    def signal(self, pid, sig):
+        ''' сигнал своему процессу
+            :return: False - такого процесса под присмотром нет (или он уже забран)
+        '''
+        with self.__lock:
+            entry = self.__procs.get(pid)
+            if entry is None:
+                return False
+            # пока процесс не забран, его pid не может достаться другому процессу
+            entry[0].send_signal(sig)
+            return True
+
+
+    def running(self):
+        ''' pid процессов под присмотром '''
+        with self.__lock:
+            return list(self.__procs)
+
+
+    def __collect(self):
+        ''' забираем завершившиеся процессы
+            :return: их pid
+        '''
+        exited = []
+        with self.__lock:
+            for (pid, (proc, pidfd)) in list(self.__procs.items()):
+                if proc.poll() is None:
+                    continue
+                del self.__procs[pid]
+                if pidfd is not None:
+                    os.close(pidfd)
+                exited.append(pid)
+        return exited
+
+
+    def __reap(self):
+        ''' цикл потока-сборщика '''
+        while True:
+            with self.__lock:
+                if self.__closed:
+                    return
+                pidfds = [pidfd for (_, pidfd) in self.__procs.values() if pidfd is not None]
+                polling = len(pidfds) < len(self.__procs)
+                wakeFd = self.__wake[0]
+            poller = select.poll()
+            poller.register(wakeFd, select.POLLIN)
+            for pidfd in pidfds:
+                poller.register(pidfd, select.POLLIN)
+            poller.poll(self.POLL_INTERVAL * 1000 if polling else None)
+            try:
+                while os.read(wakeFd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            exited = self.__collect()
+            if exited and self.onExit is not None:
+                try:
+                    self.onExit(exited)
+                except Exception:
+                    logging.getLogger('alarmClock').exception('ошибка обработки завершения плееров')
+
+
+    def close(self):
+        ''' остановка потока-сборщика (процессы плееров не останавливаются) '''
+        with self.__lock:
+            if self.__thread is None or self.__closed:
+                self.__closed = True
+                return
+            self.__closed = True
+            os.write(self.__wake[1], b'.')
+        self.__thread.join(timeout=2)
+        with self.__lock:
+            for (_, pidfd) in self.__procs.values():
+                if pidfd is not None:
+                    os.close(pidfd)
+            self.__procs = {}
+            for fd in self.__wake:
+                os.close(fd)
+
+
+
+class SpawnPlayer:
+    ''' Отдельный процесс плеера на каждый звонок '''
+
+    def __init__(self, playerApp):
+        ''' :param playerApp: приложение проигрывающее мелодию '''
+        self._playerApp = playerApp
+        self._supervisor = PlayerSupervisor()
+
+
+    @property
+    def onExit(self):
+        ''' callable(список pid): мелодии доиграли (процессы плееров завершились) '''
+        return self._supervisor.onExit
+
+
+    @onExit.setter
+    def onExit(self, onExit):
+        self._supervisor.onExit = onExit
+
+
+    def play(self, soundTrack):
+        ''' запуск мелодии
+            :param soundTrack: путь к файлу мелодии
+            :return: pid процесса, который играет мелодию
+        '''
+        proc = subprocess.Popen([self._playerApp, soundTrack, '--volume=30'], stdout=subprocess.DEVNULL)
+        self._supervisor.add(proc)
+        return proc.pid
+
+
+    def _isPlayer(self, pid):
+        ''' процесс pid - плеер (по /proc; где /proc нет - проверить нельзя, считаем что плеер) '''
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                argv0 = f.read().split(b'\0', 1)[0].decode('utf-8', 'replace')
+        except OSError:
+            return not os.path.isdir('/proc')
+        return os.path.basename(argv0) == os.path.basename(self._playerApp or '')
+
+
+    def stop(self, pid):
+        ''' остановка мелодии
+            :param pid: pid, полученный от play
+        '''
+        if self._supervisor.signal(pid, signal.SIGINT):
+            return
+        # плеер не наш (запущен прошлым экземпляром приложения) или уже доиграл:
+        # pid мог достаться другой программе - сигналим, только если это плеер
+        if not self._isPlayer(pid):
+            return
+        try:
+            os.kill(pid, signal.SIGINT)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+    def close(self):
+        ''' освобождение ресурсов плеера '''
+        self._supervisor.close()
+
+
+
+class SilentPlayer:
+    ''' Плеер, который ничего не запускает (прогон расписания): выдаёт условные номера процессов '''
+
+    def __init__(self):
+        self.__lastPid = 0
+        self.__lock = threading.Lock()
+        # мелодии не играют, поэтому и не доигрывают
+        self.onExit = None
+
+
+    def play(self, soundTrack):
+        with self.__lock:
+            self.__lastPid += 1
+            return self.__lastPid
+
+
+    def stop(self, pid):
+        pass
+
+
+    def close(self):
+        pass
+
+
+
+class IpcPlayer(SpawnPlayer):
+    ''' Один постоянно запущенный mpv, которым управляем через JSON IPC (--input-ipc-server).
+        Если процесс плеера умер - продолжаем работать как SpawnPlayer.
+        Процесс не завершается в конце мелодии, поэтому onExit о ней не сообщает - звонок снимается по maxRingSeconds
+    '''
+    # сколько ждать появления сокета после запуска плеера, сек
+    START_TIMEOUT = 5
+    # сколько ждать ответа на команду, сек: зависший плеер заменяем запуском отдельного процесса
+    COMMAND_TIMEOUT = 2
+
+
+    def __init__(self, playerApp, socketPath=None):
+        '''
+            :param playerApp: приложение проигрывающее мелодию (mpv или совместимое по IPC)
+            :param socketPath: путь к сокету управления, если пусто - во временном каталоге
+        '''
+        super().__init__(playerApp)
+        self.__socketPath = socketPath or os.path.join(tempfile.gettempdir(), f'alarm-clock-player-{os.getpid()}.sock')
+        self.__proc = None
+        self.__sock = None
+        self.__reader = None
+        self.__requestId = 0
+        self.__lock = threading.Lock()
+
+
+    def __start(self):
+        ''' запуск тёплого процесса плеера и подключение к его сокету '''
+        if os.path.exists(self.__socketPath):
+            os.unlink(self.__socketPath)
+        self.__proc = subprocess.Popen(
+            [self._playerApp, '--idle=yes', '--no-video', '--volume=30', f'--input-ipc-server={self.__socketPath}'],
+            stdout=subprocess.DEVNULL, stdin=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + self.START_TIMEOUT
+        while True:
+            try:
+                self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.__sock.connect(self.__socketPath)
+                break
+            except OSError:
+                self.__sock.close()
+                self.__sock = None
+                if self.__proc.poll() is not None or time.monotonic() > deadline:
+                    self.__kill()
+                    raise
+                time.sleep(0.05)
+        # плеер жив, но завис - ответа не ждём бесконечно (socket.timeout - это OSError)
+        self.__sock.settimeout(self.COMMAND_TIMEOUT)
+        self.__reader = self.__sock.makefile('r', encoding='utf-8')
+
+
+    def __kill(self):
+        ''' остановка тёплого процесса плеера '''
+        if self.__reader:
+            self.__reader.close()
+        if self.__sock:
+            self.__sock.close()
+        if self.__proc and self.__proc.poll() is None:
+            self.__proc.terminate()
+            try:
+                self.__proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.__proc.kill()
+        self.__proc = self.__sock = self.__reader = None
+
+
+    def __command(self, *args):
+        ''' отправка команды плееру и ожидание ответа на неё
+            :return: ответ плеера (словарь)
+        '''
+        if self.__proc is None or self.__proc.poll() is not None:
+            self.__kill()
+            self.__start()
+        self.__requestId += 1
+        self.__sock.sendall((json.dumps({'command': list(args), 'request_id': self.__requestId}) + '\n').encode('utf-8'))
+        # в сокет также приходят события плеера - пропускаем всё, что не ответ на нашу команду
+        for line in self.__reader:
+            reply = json.loads(line)
+            if reply.get('request_id') == self.__requestId:
+                return reply
+        raise ConnectionError('Плеер закрыл соединение')
+
+
+    def play(self, soundTrack):
+        with self.__lock:
+            try:
+                self.__command('loadfile', soundTrack, 'replace')
+                return self.__proc.pid
+            except (OSError, ValueError):
+                # тёплый плеер недоступен - запускаем мелодию отдельным процессом
+                self.__kill()
+        return super().play(soundTrack)
+
+
+    def stop(self, pid):
+        with self.__lock:
+            if self.__proc is not None and pid == self.__proc.pid:
+                try:
+                    self.__command('stop')
+                except (OSError, ValueError):
+                    self.__kill()
+                return
+        # мелодия, запущенная отдельным процессом (или прошлым экземпляром приложения)
+        super().stop(pid)
+
+
+    def close(self):
+        with self.__lock:
+            self.__kill()
+        if os.path.exists(self.__socketPath):
+            os.unlink(self.__socketPath)
+        super().close()
+
+
+
+class FakeIpcPlayer:
+    ''' Поддельный плеер с JSON IPC как у mpv (для тестов): не играет звук, а только записывает команды.
+        Запускается отдельным процессом вместо mpv:
+            python player.py --idle=yes --input-ipc-server=/tmp/x.sock [--log=commands.jsonl]
+        без --input-ipc-server ведёт себя как плеер "на один звонок": ждёт SIGINT/SIGTERM
+    '''
+
+    def __init__(self, socketPath, log=None):
+        '''
+            :param socketPath: путь к сокету управления
+            :param log: поток, в который пишутся полученные команды (json по строке)
+        '''
+        self.__socketPath = socketPath
+        self.__log = log
+        # все полученные команды
+        self.commands = []
+        # что сейчас "играет"
+        self.playing = None
+
+
+    def __handle(self, conn):
+        ''' обслуживание одного клиента сокета '''
+        with conn, conn.makefile('r', encoding='utf-8') as reader:
+            for line in reader:
+                request = json.loads(line)
+                command = request.get('command', [])
+                self.commands.append(command)
+                if self.__log:
+                    self.__log.write(json.dumps(command, ensure_ascii=False) + '\n')
+                    self.__log.flush()
+                if command[:1] == ['loadfile']:
+                    self.playing = command[1]
+                elif command[:1] == ['stop']:
+                    self.playing = None
+                reply = {'error': 'success', 'data': None, 'request_id': request.get('request_id')}
+                conn.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+    def serve(self):
+        ''' приём клиентов (блокирует до закрытия процесса) '''
+        if os.path.exists(self.__socketPath):
+            os.unlink(self.__socketPath)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.__socketPath)
+        server.listen()
+        while True:
+            (conn, _) = server.accept()
+            threading.Thread(target=self.__handle, args=(conn,), daemon=True).start()
+
+
+
+if __name__ == '__main__':
+    import sys
+    opts = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if arg.startswith('--') and '=' in arg)
+    if 'input-ipc-server' not in opts:
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT, signal.SIGTERM})
+        signal.sigwait({signal.SIGINT, signal.SIGTERM})
+        sys.exit(0)
+    log = open(opts['log'], 'a', encoding='utf-8') if 'log' in opts else None
+    FakeIpcPlayer(opts['input-ipc-server'], log).serve()
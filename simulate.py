@@ -0,0 +1,177 @@
+''' Прогон расписания будильников в виртуальном времени (быстрее реального).
+
+    Запуск: python simulate.py [--db ac.db] [--start 2026-10-20T00:00] [--days 7] [--log events.jsonl] [--stall-every 60]
+    Прогон идёт на копии базы: плеер не запускается, сообщения не показываются,
+    а каждый звонок, повтор и остановка пишутся в журнал (json по строке).
+    С --stall-every планировщик периодически "стоит" (база занята, пауза ВМ), а будильники,
+    которым пора звонить за время остановки, в это время меняются - звонки всё равно должны прозвучать.
+    В отчёте - сколько минут расписания прогоняется за секунду и расхождения первых звонков
+    с расписанием, посчитанным по условиям будильников (evaluator.AlarmTable).
+'''
+import argparse, datetime, json, os, sqlite3, sys, tempfile, threading, time
+
+import alarmClock as ac
+from clock import VirtualClock
+from evaluator import AlarmTable
+
+
+class StallingClock(VirtualClock):
+    ''' Виртуальные часы с остановками планировщика: раз в every ожидание затягивается на stall,
+        а будильники, которым пора звонить за время остановки, меняются (как из другого соединения)
+    '''
+
+    def __init__(self, start, end, onEnd, every, stall, table):
+        '''
+            :param every: как часто останавливать планировщик (timedelta)
+            :param stall: длительность остановки (timedelta)
+            :param table: условия будильников (evaluator.AlarmTable)
+        '''
+        super().__init__(start, end, onEnd)
+        self.__every = every
+        self.__stall = stall
+        self.__table = table
+        self.__nextStall = start + every
+        # сколько будильников изменено во время остановок
+        self.edits = 0
+
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+        now = self.now()
+        wake = now + datetime.timedelta(seconds=timeout)
+        if wake < self.__nextStall:
+            return super().wait(event, timeout)
+        self.__nextStall = wake + self.__every
+        wake += self.__stall
+        ids = sorted({aId for (_, aId) in self.__table.dueBetween(now, wake)})
+        if ids:
+            ac.app.db.write("update alarms set msg = coalesce(msg, '') || '.' where id = ?", [(aId,) for aId in ids], many=True).result()
+            ac.alarmsChanged.set()
+            self.edits += len(ids)
+        self.advance((wake - now).total_seconds())
+        return event.is_set()
+
+
+
+class Simulation:
+    ''' Прогон планировщика на копии базы с виртуальными часами '''
+    # сколько расхождений с расписанием показывать в отчёте
+    REPORT_LIMIT = 20
+    # длительность остановки планировщика (в пределах окна опоздания звонков)
+    STALL = datetime.timedelta(minutes=5)
+
+
+    def __init__(self, dbFile, start, span, log=None, stallEvery=None):
+        '''
+            :param dbFile: база будильников (сама не меняется)
+            :param start: начальный момент (datetime)
+            :param span: длительность прогона (timedelta)
+            :param log: поток для журнала событий
+            :param stallEvery: как часто останавливать планировщик с правкой будильников (timedelta, None - без остановок)
+        '''
+        self.__dbFile = dbFile
+        self.__start = start
+        self.__end = start + span
+        self.__log = log
+        self.__stallEvery = stallEvery
+        self.__lock = threading.Lock()
+        self.__events = {}
+        self.__rings = set()
+
+
+    def __record(self, event, aId, moment, details):
+        ''' запись события звонка (вызывается из потоков планировщика и пула звонков) '''
+        with self.__lock:
+            self.__events[event] = self.__events.get(event, 0) + 1
+            if event == 'ring':
+                self.__rings.add((details['fireAt'], aId))
+            if self.__log:
+                entry = {'t': moment.isoformat(), 'event': event, 'id': aId}
+                entry.update((key, value.isoformat() if isinstance(value, datetime.datetime) else value) for (key, value) in details.items())
+                self.__log.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+    def __expected(self):
+        ''' первые звонки по условиям будильников за время прогона '''
+        table = AlarmTable.fromDb(ac.app.db.reader())
+        expected = set()
+        start = self.__start
+        while start < self.__end:
+            end = min(start + datetime.timedelta(days=1), self.__end)
+            expected.update(table.dueBetween(start, end))
+            start = end
+        return expected
+
+
+    def run(self):
+        ''' прогон
+            :return: отчёт (словарь)
+        '''
+        prevApp = ac.app
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = os.path.join(tmpDir, 'simulation.db')
+            src, dst = sqlite3.connect(self.__dbFile), sqlite3.connect(path)
+            src.backup(dst)
+            src.close()
+            dst.close()
+            ac.app = ac.AppContext({
+                'dbFile': path, 'playerMode': 'none', 'player': 'simulation', 'sound': 'simulation',
+                'notifier': 'none', 'soundDir': '', 'instanceId': 'simulation', 'metricsPort': '', 'metricsFile': '',
+            })
+            try:
+                # прогон начинается с чистого состояния звонков
+                ac.app.db.write('update alarms set pid = null, owner = null where pid is not null')
+                ac.app.db.write('delete from repeats')
+                ac.app.db.write('delete from claims')
+                ac.app.db.write('delete from meta where key = ?', (ac.AlarmScheduler.WATERMARK_KEY,)).result()
+                expected = self.__expected()
+                ac.app.recorder = self.__record
+                scheduler = ac.AlarmScheduler()
+                if self.__stallEvery:
+                    table = AlarmTable.fromDb(ac.app.db.reader())
+                    clock = StallingClock(self.__start, self.__end, scheduler.stop, self.__stallEvery, self.STALL, table)
+                else:
+                    clock = VirtualClock(self.__start, self.__end, scheduler.stop)
+                ac.app.clock = clock
+                started = time.perf_counter()
+                scheduler.run()
+                wall = time.perf_counter() - started
+            finally:
+                ac.app.close()
+                ac.app = prevApp
+        minutes = (self.__end - self.__start).total_seconds() / 60
+        missing = sorted(expected - self.__rings)
+        unexpected = sorted(self.__rings - expected)
+        return {
+            'start': self.__start.isoformat(), 'end': self.__end.isoformat(),
+            'simulatedMinutes': minutes, 'wallSeconds': wall, 'minutesPerSecond': minutes / wall if wall else None,
+            'events': dict(self.__events), 'expectedRings': len(expected),
+            'stallEdits': getattr(clock, 'edits', 0),
+            'missing': [(fireAt.isoformat(), aId) for (fireAt, aId) in missing[:self.REPORT_LIMIT]], 'missingCount': len(missing),
+            'unexpected': [(fireAt.isoformat(), aId) for (fireAt, aId) in unexpected[:self.REPORT_LIMIT]], 'unexpectedCount': len(unexpected),
+        }
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Прогон расписания будильников в виртуальном времени')
+    parser.add_argument('--db', default=None, help='база будильников (по умолчанию настройка dbFile)')
+    parser.add_argument('--start', default=None, help='начало прогона, ГГГГ-ММ-ДДTчч:мм (по умолчанию - начало текущей минуты)')
+    parser.add_argument('--days', type=float, default=1, help='длительность прогона в сутках')
+    parser.add_argument('--log', default='', help='файл журнала событий (json по строке)')
+    parser.add_argument('--stall-every', type=float, default=0, help='останавливать планировщик (с правкой будильников) раз в столько минут')
+    args = parser.parse_args()
+
+    ac.app.configureLogging()
+    start = datetime.datetime.fromisoformat(args.start) if args.start else datetime.datetime.now().replace(second=0, microsecond=0)
+    log = open(args.log, 'w', encoding='utf-8') if args.log else None
+    try:
+        stallEvery = datetime.timedelta(minutes=args.stall_every) if args.stall_every > 0 else None
+        report = Simulation(args.db or ac.app.dbFile, start, datetime.timedelta(days=args.days), log, stallEvery).run()
+    finally:
+        if log:
+            log.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report['missingCount'] or report['unexpectedCount']:
+        sys.exit(1)
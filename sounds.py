@@ -0,0 +1,97 @@
+''' Индекс мелодий каталога soundDir в базе будильников '''
+import json, os, shutil, subprocess, wave
+
+
+class SoundLibrary:
+    ''' Мелодии каталога с постоянными id. Каталог пересканируется только если он изменился,
+        а метаданные (размер, mtime, длительность) перечитываются только у изменившихся файлов
+    '''
+    # ключ в таблице meta, где хранится mtime каталога на момент последнего сканирования
+    DIR_MTIME_KEY = 'soundDirMtime'
+
+
+    def __init__(self, soundDir):
+        ''' :param soundDir: каталог с мелодиями '''
+        self.__soundDir = soundDir
+        self.__ffprobe = shutil.which('ffprobe')
+
+
+    def duration(self, path):
+        ''' длительность мелодии в секундах (None - определить не удалось) '''
+        if path.lower().endswith('.wav'):
+            try:
+                with wave.open(path) as w:
+                    return w.getnframes() / w.getframerate()
+            except (OSError, wave.Error, EOFError):
+                return None
+        if not self.__ffprobe:
+            return None
+        try:
+            out = subprocess.run(
+                [self.__ffprobe, '-v', 'quiet', '-print_format', 'json', '-show_format', path],
+                capture_output=True, text=True, timeout=10
+            ).stdout
+            return float(json.loads(out)['format']['duration'])
+        except (OSError, subprocess.TimeoutExpired, ValueError, KeyError):
+            return None
+
+
+    def rescan(self, db, force=False):
+        ''' обновление индекса мелодий (файлы читаются в этом потоке, в базу пишется одной транзакцией)
+            :param db: база будильников (db.Database)
+            :param force: сканировать, даже если mtime каталога не изменился (файл перезаписан на месте)
+            :return: число добавленных/изменённых/пропавших мелодий
+        '''
+        if not self.__soundDir or not os.path.isdir(self.__soundDir):
+            return 0
+        dirMtime = os.stat(self.__soundDir).st_mtime_ns
+        con = db.reader()
+        stored = con.execute('select value from meta where key = ?', (self.DIR_MTIME_KEY,)).fetchone()
+        if not force and stored and int(stored[0]) == dirMtime:
+            return 0
+
+        known = {path: (sId, size, mtime, present) for (sId, path, size, mtime, present) in con.execute('select id, path, size, mtime, present from sounds')}
+        seen = set()
+        updated = []
+        added = []
+        for entry in os.scandir(self.__soundDir):
+            if not entry.is_file():
+                continue
+            seen.add(entry.path)
+            st = entry.stat()
+            old = known.get(entry.path)
+            if old and old[1:] == (st.st_size, st.st_mtime_ns, 1):
+                continue
+            row = (st.st_size, st.st_mtime_ns, self.duration(entry.path), entry.path,)
+            if old:
+                updated.append(row)
+            else:
+                added.append((*row, entry.name,))
+        # пропавшие файлы не удаляем - id остаются за ними, будильники просто играют стандартную мелодию
+        gone = [(sId,) for (path, (sId, _, _, present)) in known.items() if present and path not in seen]
+
+        def write(con):
+            con.executemany('update sounds set size = ?, mtime = ?, duration = ?, present = 1 where path = ?', updated)
+            con.executemany('insert into sounds (size, mtime, duration, path, name) values (?, ?, ?, ?, ?)', added)
+            con.executemany('update sounds set present = 0 where id = ?', gone)
+            con.execute('insert or replace into meta (key, value) values (?, ?)', (self.DIR_MTIME_KEY, str(dirMtime)))
+        db.call(write).result()
+        return len(updated) + len(added) + len(gone)
+
+
+    @staticmethod
+    def path(con, soundId):
+        ''' путь к мелодии по id (None - нет такой или файл пропал) '''
+        row = con.execute('select path from sounds where id = ? and present = 1', (soundId,)).fetchone()
+        return row[0] if row else None
+
+
+    @staticmethod
+    def search(con, text='', limit=20):
+        ''' поиск мелодий по части имени
+            :return: список (id, имя, длительность)
+        '''
+        return con.execute(
+            'select id, name, duration from sounds where present = 1 and name like ? order by name limit ?',
+            (f'%{text}%', limit,)
+        ).fetchall()